@@ -3,7 +3,7 @@ Function code
 '''
 import numpy as np
 import xarray as xr
-from scipy.stats import gaussian_kde
+import cftime
 
 def Region_ERA(region, lat_filter=True):
     if region == "Atlantic JJA":
@@ -40,125 +40,508 @@ def Region_CESM(region):
 
     return np.array([Lon1, Lon2, Lat1, Lat2])
 
-def datetime_conversion(datestamp):
+def region_box(region, dataset="ERA", lat_filter=True):
+    '''[Lon1, Lon2, Lat1, Lat2] of a region, e.g. "Atlantic DJF", for the ERA or CESM grid'''
+    if dataset == "CESM":
+        box = Region_CESM(region)
+        if lat_filter==False:
+            box[2], box[3] = -90, 90
+        return box
+    return Region_ERA(region, lat_filter)
+
+def in_lon_range(lon, Lon1, Lon2):
+    '''True where lon is inside [Lon1, Lon2], Lon1 > Lon2 wraps across 0°'''
+    lon = np.asarray(lon) % 360
+    Lon1, Lon2 = Lon1 % 360, (Lon2 % 360 if Lon2 % 360 != 0 else 360)
+    return ((Lon1 <= lon) & (lon <= Lon2)) if Lon1 <= Lon2 else ((Lon1 <= lon) | (lon <= Lon2))
+
+def in_region(lon, lat, box):
+    '''True where (lon, lat) is inside box [Lon1, Lon2, Lat1, Lat2], Lon1 > Lon2 wraps across 0°'''
+    Lon1, Lon2, Lat1, Lat2 = box
+    lat = np.asarray(lat)
+    return in_lon_range(lon, Lon1, Lon2) & (Lat1 <= lat) & (lat <= Lat2)
+
+_region_index_cache = {}
+
+def region_index(lon, lat, region, dataset="ERA", lat_filter=True):
     """
-    Convert datestamp to datetime64
+    Integer indexers of a region box on a (lat, lon) grid, computed once per grid and region
+    
+    Parameters:
+    -----------
+    lon, lat : np.ndarray
+        1D monotonic grid coordinates
+    region : str
+        e.g. "Atlantic DJF"
+    dataset : str, default="ERA"
+        "ERA" for Region_ERA boxes, "CESM" for Region_CESM boxes
+        
+    Returns:
+    --------
+    dict
+        'lon' : slice, or ascending int array when the box wraps across 0°
+        'lon_slices' : list of one or two slices covering the box in grid order
+        'lat' : slice
     """
-    # Check the data type of datestamp and convert if needed
-    print(f"Original dtype: {datestamp.dtype}")
-    
-    # If it's not already a datetime64 type, convert it
-    if not np.issubdtype(datestamp.dtype, np.datetime64):
-        print("Converting to datetime64[D]...")
-        try:
-            # Method 1: Try direct conversion
-            start_dates_np = np.array(datestamp, dtype='datetime64[D]')
-        except Exception as e:
-            print(f"Direct conversion failed: {e}")
-            # Method 2: Try string conversion
-            try:
-                start_dates_np = np.array([np.datetime64(str(d)) for d in datestamp])
-            except Exception as e:
-                print(f"String conversion failed: {e}")
-                # Method 3: Check for datetime accessor
-                if hasattr(datestamp, 'dt'):
-                    start_dates_np = datestamp.dt.values
-                else:
-                    raise TypeError("Could not convert datestamp to datetime64")
+    lon, lat = np.asarray(lon), np.asarray(lat)
+    key = (region, dataset, lat_filter,
+           lon.dtype.str, lon.shape, lon.tobytes(), lat.dtype.str, lat.shape, lat.tobytes())
+    if key not in _region_index_cache:
+        Lon1, Lon2, Lat1, Lat2 = region_box(region, dataset, lat_filter)
+        lon_in = np.flatnonzero(in_lon_range(lon, Lon1, Lon2))
+        lat_in = np.flatnonzero((Lat1 <= lat) & (lat <= Lat2))
+
+        breaks = np.flatnonzero(np.diff(lon_in) != 1) + 1
+        lon_slices = [slice(int(run[0]), int(run[-1]) + 1) for run in np.split(lon_in, breaks) if len(run)]
+        lat_slice = slice(int(lat_in[0]), int(lat_in[-1]) + 1) if len(lat_in) else slice(0, 0)
+        _region_index_cache[key] = {
+            'lon': lon_slices[0] if len(lon_slices) == 1 else lon_in,
+            'lon_slices': lon_slices,
+            'lat': lat_slice,
+        }
+    return _region_index_cache[key]
+
+def subset_region(ds, region, lon_name="lon", lat_name="lat", dataset="ERA", lat_filter=True):
+    '''lazy isel of a region box from a gridded dataset, without building a full-grid mask'''
+    index = region_index(ds[lon_name].values, ds[lat_name].values, region, dataset, lat_filter)
+    return ds.isel({lon_name: index['lon'], lat_name: index['lat']})
+
+def region_center_lon(region):
+    '''center longitude of a region box, e.g. "Atlantic DJF", across the dateline if needed'''
+    Lon1, Lon2, _, _ = Region_ERA(region, lat_filter=True)
+    return (Lon1+(Lon2-Lon1)%360/2)%360
+
+def season_length(season):
+    '''number of days in a season on the noleap calendar'''
+    if season == "DJF":
+        season_days = 90
+    elif season == "JJA":
+        season_days = 92
     else:
-        # If it's already datetime64, just extract the values
-        print("Already datetime64 type...")
-        start_dates_np = datestamp
+        raise ValueError("Invalid season. Choose 'JJA' or 'DJF'.")
+    return season_days
+
+def _checked_unit(dates, unit):
+    '''datetime64 dates in the given unit, ValueError instead of a silent overflow (e.g. ns outside 1678-2262)'''
+    converted = dates.astype(f'datetime64[{unit}]')
+    source = np.datetime_data(dates.dtype)[0]
+    if source != 'generic' and np.timedelta64(1, unit) < np.timedelta64(1, source):
+        valid = ~np.isnat(dates)
+        if np.any(converted[valid].astype(dates.dtype) != dates[valid]):
+            raise ValueError(f"dates outside the datetime64[{unit}] range, use unit='s' or 'D'")
+    return converted
+
+def to_datetime64(times, unit='ns'):
+    """
+    Vectorized conversion of cftime, object or string dates to datetime64, memoized per time axis (read-only result)
+    
+    cftime dates are rebuilt from their year/month/day fields, so noleap and 360_day dates
+    keep their calendar date (30 Feb on 360_day becomes the last day of February).
+    
+    Parameters:
+    -----------
+    times : array-like
+        Dates to convert
+    unit : str, default='ns'
+        datetime64 unit of the result; use 's' or 'D' for years outside 1678-2262, 'ns'
+        raises ValueError for them
         
-    return start_dates_np
+    Returns:
+    --------
+    np.ndarray
+        datetime64 array of the same shape
+    """
+    times = np.asarray(getattr(times, 'values', times))
+    if np.issubdtype(times.dtype, np.datetime64):
+        return _checked_unit(times, unit)
+    if not (times.size and hasattr(times.flat[0], 'calendar')):
+        return _checked_unit(times.astype('datetime64'), unit)
+
+    fields = calendar_fields(times)
+    if ('datetime64', unit) not in fields:
+        flat = times.ravel()
+        seconds = np.fromiter((t.hour*3600 + t.minute*60 + t.second for t in flat), dtype='int64', count=flat.size)
+        months = np.datetime64('1970-01', 'M') + ((fields['year'] - 1970) * 12 + fields['month'] - 1).ravel()
+        month_length = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype('int64')
+        day = np.minimum(fields['day'].ravel(), month_length)
+        dates = months.astype('datetime64[D]') + (day - 1) + seconds.astype('timedelta64[s]')
+        dates = _checked_unit(dates, unit).reshape(times.shape)
+        dates.setflags(write=False)
+        fields[('datetime64', unit)] = dates
+    return fields[('datetime64', unit)]
+
+def datetime_conversion(datestamp):
+    """
+    Convert datestamp to datetime64
+    """
+    # If it's already datetime64, just return it
+    if np.issubdtype(datestamp.dtype, np.datetime64):
+        return datestamp
+    try:
+        return to_datetime64(datestamp, unit='D')
+    except Exception as e:
+        # Check for datetime accessor
+        if hasattr(datestamp, 'dt'):
+            return datestamp.dt.values
+        raise TypeError("Could not convert datestamp to datetime64") from e
 
-def ds_datetime_conversion(ds, date_field='time'):
+def ds_datetime_conversion(ds, date_field='time', unit='s'):
     """
     Convert date field (coordinate or variable) in an xarray Dataset to datetime64
     
+    Only the date field is replaced; the returned dataset shares all other variables
+    with ds, without copying their data.
+    
     Parameters:
     -----------
     ds : xarray.Dataset
         The xarray dataset containing the date field to convert
     date_field : str, default='time'
         The name of the coordinate or variable containing dates to convert
+    unit : str, default='s'
+        datetime64 unit, covering the years of CESM control runs; 'ns' raises ValueError
+        for years outside 1678-2262
         
     Returns:
     --------
     xarray.Dataset
         The dataset with the date field converted to datetime64
     """ 
-    # Make a copy to avoid modifying the original
-    result_ds = ds.copy()
-    
     # Check if the field exists as either a coordinate or variable
-    is_coord = date_field in result_ds.coords
-    is_var = date_field in result_ds.data_vars
+    is_coord = date_field in ds.coords
+    is_var = date_field in ds.data_vars
     
     if not (is_coord or is_var):
         raise ValueError(f"'{date_field}' not found in dataset coordinates or variables")
     
-    # Get the data array (works for both coords and variables)
-    data_array = result_ds[date_field]
-    datestamp = data_array.values
-    print(f"Original dtype: {datestamp.dtype}")
+    data_array = ds[date_field]
+    if np.issubdtype(data_array.dtype, np.datetime64):
+        return ds
+
+    try:
+        converted_dates = to_datetime64(data_array.values, unit)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise TypeError("Could not convert date field to datetime64") from e
+
+    new_variable = xr.Variable(data_array.dims, converted_dates, attrs=data_array.attrs)
+    if is_coord:
+        return ds.assign_coords({date_field: new_variable})
+    return ds.assign({date_field: new_variable})
+
+def day_numbers(times):
+    """
+    Convert a time axis to integer day numbers since 1970-01-01 in its own calendar
     
-    # If it's not already a datetime64 type, convert it
-    if not np.issubdtype(datestamp.dtype, np.datetime64):
-        print(f"Converting {date_field} to datetime64[ns]...")
+    Parameters:
+    -----------
+    times : array-like
+        datetime64, cftime or date-string values (numpy array, list or xarray DataArray)
         
-        # Method 2: Try numpy conversion
-        try:
-            converted_dates = np.array(datestamp, dtype='datetime64[ns]')
-            
-            new_data_array = xr.DataArray(
-                converted_dates,
-                dims=data_array.dims,
-                coords={k: data_array.coords[k] for k in data_array.coords if k != date_field},
-                attrs=data_array.attrs
-            )
-            
-            if is_coord:
-                result_ds = result_ds.assign_coords({date_field: new_data_array})
-            else:  # is_var
-                result_ds[date_field] = new_data_array
-                
-        except Exception as e:
-            print(f"Direct conversion failed: {e}")
-            
-            # Method 3: Try string conversion
-            try:
-                converted_dates = np.array([np.datetime64(str(d)) for d in datestamp])
-                
-                new_data_array = xr.DataArray(
-                    converted_dates,
-                    dims=data_array.dims,
-                    coords={k: data_array.coords[k] for k in data_array.coords if k != date_field},
-                    attrs=data_array.attrs
-                )
-                
-                if is_coord:
-                    result_ds = result_ds.assign_coords({date_field: new_data_array})
-                else:  # is_var
-                    result_ds[date_field] = new_data_array
-                    
-            except Exception as e:
-                print(f"String conversion failed: {e}")
-                raise TypeError("Could not convert date field to datetime64")
+    Returns:
+    --------
+    np.ndarray
+        int64 day numbers, comparable only within the same calendar
+    """
+    return calendar_fields(times)['days']
+
+def timeline_index(time_values):
+    """
+    Build a sorted day index for a time axis, reusable for any number of event lookups
+    
+    Returns:
+    --------
+    sorted_days : np.ndarray
+        Day numbers of the time axis in ascending order
+    order : np.ndarray
+        Positions of sorted_days in the original time axis
+    """
+    days = day_numbers(time_values)
+    order = np.argsort(days, kind='stable')
+    return days[order], order
+
+def onset_gaps(onset_mask):
+    '''return the number of days between consecutive True values in a boolean array'''
+    true_indices = np.flatnonzero(onset_mask)
+    return np.diff(true_indices) - 1
+
+def season_segments(times, season):
+    '''(starts, stops) of every season on a sorted time axis, the segments of segmented_gaps'''
+    ranges = season_ranges(times, season)
+    if any(not isinstance(r, slice) for r in ranges.values()):
+        raise ValueError("time axis must be sorted")
+    return (np.array([r.start for r in ranges.values()], dtype=int),
+            np.array([r.stop for r in ranges.values()], dtype=int))
+
+def segmented_gaps(onset_mask, segments=None, censored=False):
+    """
+    Days between consecutive onsets within each segment (season, year, member), in one pass
+
+    Gaps never run across segment boundaries. For a 2-D mask each row is a member on
+    the same time axis, and every segment is repeated for every member.
+
+    Parameters:
+    -----------
+    onset_mask : np.ndarray
+        bool (ntime,) or (nmember, ntime)
+    segments : tuple of np.ndarray, optional
+        (starts, stops) time indices of the segments, e.g. from season_segments;
+        one segment per row when None. Onsets outside every segment are ignored.
+    censored : bool, default=False
+        Also return the runs cut by segment edges
+
+    Returns:
+    --------
+    gaps : np.ndarray
+        Within-segment gaps, in time order
+    segment : np.ndarray
+        Segment of each gap, member * nsegment + segment index
+    left, right : np.ndarray
+        Only if censored: (nmember * nsegment,) days before the first onset and after the
+        last onset of each segment; both are the segment length when it has no onset
+    """
+    onset_mask = np.atleast_2d(onset_mask)
+    nmember, ntime = onset_mask.shape
+    starts, stops = (np.array([0]), np.array([ntime])) if segments is None else map(np.asarray, segments)
+
+    # Segments of all members on the flattened mask
+    offsets = (np.arange(nmember)[:, None] * ntime)
+    starts, stops = (offsets + starts).ravel(), (offsets + stops).ravel()
+    order = np.argsort(starts, kind='stable')
+    onsets = np.flatnonzero(onset_mask)
+    seg = np.searchsorted(starts[order], onsets, side='right') - 1
+    inside = (seg >= 0) & (onsets < stops[order][np.maximum(seg, 0)])
+    onsets, seg = onsets[inside], order[seg[inside]]
+
+    same = seg[1:] == seg[:-1]
+    gaps, segment = (np.diff(onsets) - 1)[same], seg[1:][same]
+    if not censored:
+        return gaps, segment
+
+    length = stops - starts
+    left, right = length.copy(), length.copy()
+    first = np.concatenate([[True], ~same]) if len(seg) else np.array([], dtype=bool)
+    last = np.concatenate([~same, [True]]) if len(seg) else np.array([], dtype=bool)
+    left[seg[first]] = onsets[first] - starts[seg[first]]
+    right[seg[last]] = stops[seg[last]] - 1 - onsets[last]
+    return gaps, segment, left, right
+
+def map_events_to_timeline(time_values, event_dates, index=None):
+    """
+    Map event dates onto a time axis with searchsorted instead of per-event scans
+    
+    Parameters:
+    -----------
+    time_values : array-like
+        Time axis (datetime64 or cftime), sorted or not
+    event_dates : array-like
+        Event onset dates in the same calendar as time_values
+    index : tuple, optional
+        Output of timeline_index(time_values), to reuse across calls
+        
+    Returns:
+    --------
+    onset_mask : np.ndarray
+        bool (ntime,), True on days of the time axis that match an event date
+    nearest_index : np.ndarray
+        int (nevent,), index of the closest day on the time axis for each event
+    gaps : np.ndarray
+        Days between consecutive onsets along the time axis
+    """
+    sorted_days, order = timeline_index(time_values) if index is None else index
+    event_days = day_numbers(event_dates)
+    ntime = len(sorted_days)
+
+    onset_mask = np.zeros(ntime, dtype=bool)
+    if ntime == 0 or event_days.size == 0:
+        return onset_mask, np.zeros(event_days.shape, dtype=int), np.array([], dtype=int)
+
+    right = np.clip(np.searchsorted(sorted_days, event_days), 0, ntime - 1)
+    left = np.clip(right - 1, 0, ntime - 1)
+    use_left = np.abs(event_days - sorted_days[left]) <= np.abs(sorted_days[right] - event_days)
+    nearest = np.where(use_left, left, right)
+
+    exact = sorted_days[nearest] == event_days
+    nearest_index = order[nearest]
+    onset_mask[nearest_index[exact]] = True
+
+    return onset_mask, nearest_index, onset_gaps(onset_mask)
+
+_calendar_cache = {}
+_CALENDAR_CACHE_SIZE = 64
+_NOLEAP_MONTH_START = np.array([0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365])
+
+def calendar_fields(times):
+    """
+    Integer day numbers, year, month and day of month of a time axis, converted once and cached
+    
+    datetime64 and numeric axes are identified by their raw bytes. Hashing cftime date
+    objects costs about as much as converting them, so object axes are identified by
+    their buffer (address, shape, strides); the cache keeps the array, so the address
+    is not reused while the entry exists, and every .values view of a file's axis hits
+    the same entry. An object axis changed in place is not seen. The cached arrays are
+    read-only.
+    
+    Returns:
+    --------
+    dict
+        'days', 'year', 'month', 'day' int64 arrays and 'calendar'
+    """
+    times = np.asarray(getattr(times, 'values', times))
+    if times.size == 0:
+        empty = np.array([], dtype='int64')
+        return {'days': empty, 'year': empty, 'month': empty, 'day': empty, 'calendar': 'standard'}
+    calendar = getattr(times.flat[0], 'calendar', 'standard')
+    if times.dtype == object:
+        key = (calendar, 'object', times.__array_interface__['data'][0], times.shape, times.strides)
+    else:
+        key = (calendar, times.dtype.str, times.shape, times.tobytes())
+    if key in _calendar_cache:
+        return _calendar_cache[key][1]
+
+    if hasattr(times.flat[0], 'calendar'):
+        year = np.fromiter((t.year for t in times.flat), dtype='int64', count=times.size)
+        month = np.fromiter((t.month for t in times.flat), dtype='int64', count=times.size)
+        day = np.fromiter((t.day for t in times.flat), dtype='int64', count=times.size)
+        if calendar in ('noleap', '365_day'):
+            days = (year - 1970) * 365 + _NOLEAP_MONTH_START[month - 1] + day - 1
+        elif calendar == '360_day':
+            days = (year - 1970) * 360 + (month - 1) * 30 + day - 1
+        elif calendar in ('standard', 'gregorian', 'proleptic_gregorian'):
+            months = (year - 1970) * 12 + month - 1
+            days = (np.datetime64('1970-01', 'M') + months).astype('datetime64[D]').astype('int64') + day - 1
+        else:
+            epoch = cftime.datetime(1970, 1, 1, calendar=calendar).toordinal()
+            days = np.fromiter((t.toordinal() for t in times.flat), dtype='int64', count=times.size) - epoch
+        days = days.reshape(times.shape)
     else:
-        # If it's already datetime64, no conversion needed
-        print("Already datetime64 type...")
+        dates = times.astype('datetime64[D]')
+        days = dates.astype('int64')
+        year = dates.astype('datetime64[Y]').astype('int64') + 1970
+        month = dates.astype('datetime64[M]').astype('int64') % 12 + 1
+        day = (dates - dates.astype('datetime64[M]')).astype('int64') + 1
+
+    fields = {'days': days, 'calendar': calendar}
+    for name, value in (('year', year), ('month', month), ('day', day)):
+        fields[name] = np.asarray(value, dtype='int64').reshape(times.shape)
+    for name in ('days', 'year', 'month', 'day'):
+        fields[name].setflags(write=False)
+    if len(_calendar_cache) >= _CALENDAR_CACHE_SIZE:
+        _calendar_cache.pop(next(iter(_calendar_cache)))
+    _calendar_cache[key] = (times, fields)
+    return fields
+
+def season_ranges(times, season):
+    """
+    Index ranges of every DJF or JJA season on a time axis, from one pass over the axis
+    
+    DJF of YEAR runs from 1 Dec YEAR to 28 Feb YEAR+1 (29 Feb is left out, as on the
+    noleap calendar); JJA of YEAR runs from 1 Jun to 31 Aug.
+    
+    Parameters:
+    -----------
+    times : array-like
+        datetime64 or cftime time axis, sorted or not
+    season : str
+        "DJF" or "JJA"
+        
+    Returns:
+    --------
+    dict
+        {YEAR: index}, index is a slice on a sorted axis, else an int array in time order
+    """
+    fields = calendar_fields(times)
+    month, day, year = fields['month'], fields['day'], fields['year']
+    if season == "DJF":
+        member = np.isin(month, (12, 1, 2)) & ~((month == 2) & (day == 29))
+        season_year = year - (month < 12)
+    elif season == "JJA":
+        member = np.isin(month, (6, 7, 8))
+        season_year = year
+    else:
+        raise ValueError("Invalid season. Choose 'JJA' or 'DJF'.")
+
+    order = np.argsort(fields['days'], kind='stable')
+    is_sorted = np.array_equal(order, np.arange(len(order)))
+    index = order[member[order]]
+    years, starts, counts = np.unique(season_year[index], return_index=True, return_counts=True)
+
+    ranges = {}
+    for YEAR, start, count in zip(years.tolist(), starts, counts):
+        if is_sorted:
+            ranges[YEAR] = slice(int(index[start]), int(index[start + count - 1]) + 1)
+        else:
+            ranges[YEAR] = index[start:start + count]
+    return ranges
+
+def kde_modes(samples, ngrid=1000, batch_size=256):
+    """
+    Mode of a Gaussian KDE for many samples at once, via linear binning and FFT convolution
     
-    return result_ds
+    Uses the same Scott's-rule bandwidth and the same ngrid-point grid between each
+    sample's min and max as scipy.stats.gaussian_kde, so modes agree within one grid step.
+    
+    Parameters:
+    -----------
+    samples : list of array-like
+        1D samples, e.g. return periods for each region/season/dataset or resample
+    ngrid : int, default=1000
+        Number of grid points between min and max of each sample
+    batch_size : int, default=256
+        Samples convolved together, bounds memory to batch_size x 3*ngrid floats
+        
+    Returns:
+    --------
+    np.ndarray
+        Modal value per sample, NaN for samples with fewer than two values
+    """
+    samples = [np.asarray(Return, dtype=float).ravel() for Return in samples]
+    modes = np.full(len(samples), np.nan)
+    nfft = 1 << int(np.ceil(np.log2(3 * ngrid - 2)))
+    offsets = np.arange(-(ngrid - 1), ngrid)
+
+    for start in range(0, len(samples), batch_size):
+        batch = samples[start:start + batch_size]
+        n = np.array([len(Return) for Return in batch])
+        values = np.concatenate(batch) if len(batch) else np.array([])
+        rows = np.repeat(np.arange(len(batch)), n)
+        valid = n > 1
+        nrows = len(batch)
+        if not valid.any():
+            continue
+
+        lo = np.full(nrows, np.inf)
+        hi = np.full(nrows, -np.inf)
+        np.minimum.at(lo, rows, values)
+        np.maximum.at(hi, rows, values)
+        mean = np.bincount(rows, values, nrows) / np.maximum(n, 1)
+        var = np.bincount(rows, (values - mean[rows])**2, nrows) / np.maximum(n - 1, 1)
+        bw = np.sqrt(var) * np.maximum(n, 1)**(-1/5)
+
+        # Linear binning onto each sample's grid
+        dx = np.where(hi > lo, (hi - lo) / (ngrid - 1), 1.0)
+        pos = (values - lo[rows]) / dx[rows]
+        i0 = np.clip(np.floor(pos).astype(int), 0, ngrid - 2)
+        w1 = pos - i0
+        counts = (np.bincount(rows*ngrid + i0, 1 - w1, nrows*ngrid)
+                  + np.bincount(rows*ngrid + i0 + 1, w1, nrows*ngrid)).reshape(nrows, ngrid)
+
+        # Gaussian kernel in grid units, convolved in Fourier space
+        with np.errstate(divide='ignore', invalid='ignore'):
+            h = np.where(bw > 0, bw / dx, np.inf)[:, None]
+            kernel = np.where(np.isfinite(h), np.exp(-0.5 * (offsets / h)**2), offsets == 0)
+        density = np.fft.irfft(np.fft.rfft(counts, nfft) * np.fft.rfft(kernel, nfft), nfft)
+        density = density[:, ngrid - 1:2*ngrid - 1]
+
+        max_idx = np.argmax(density, axis=1)
+        modes[start:start + nrows] = np.where(valid, lo + max_idx * dx, np.nan)
+    return modes
 
 def kde(Return):
     if len(Return) <= 1:
         return None  
-    kde = gaussian_kde(Return)
-    x_vals = np.linspace(Return.min(), Return.max(), 1000)  
-    kde_vals = kde(x_vals)
-    max_idx = np.argmax(kde_vals)
-    max_x = x_vals[max_idx]
+    max_x = kde_modes([Return])[0]
     return max_x
 
 def stat(ds):
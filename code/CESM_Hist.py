@@ -8,23 +8,24 @@ import numpy as np
 import matplotlib.pyplot as plt
 import xarray as xr
 import os
-from scipy.stats import gaussian_kde
 import matplotlib.patches as mpatches
+import BlockingDetectionFunctions
+import CurveFunctions
+import DataAccessFunctions
+import HistogramFunctions
+import RenderFunctions
+import InstrumentFunctions
 basepath = os.path.expanduser("~/Github")
 Savingpath = f"{basepath}/plots/CESM_Hist/"
 os.makedirs(Savingpath, exist_ok=True)
 
 def kde (Return):
-    kde = gaussian_kde(Return)
-    x_vals = np.linspace(Return.min(), Return.max(), 1000)  
-    kde_vals = kde(x_vals)
-    max_idx = np.argmax(kde_vals)
-    max_x = x_vals[max_idx]
-    return max_x
+    return BlockingDetectionFunctions.kde(Return)
 
+@InstrumentFunctions.instrumented
 def load_phi(data, region, season):
     filepath = f"{basepath}/data/CESM1/regional_lwa"
-    ds = xr.open_dataset(f"{filepath}/{data}/{region}_{season}.nc")
+    ds = DataAccessFunctions.open_dataset(f"{filepath}/{data}/{region}_{season}.nc")
     phi = ds['temp_corr']
     mean = ds['temp_corr']
     return phi.values, mean.values
@@ -39,36 +40,43 @@ def calculate_Pk(data, season, nevent):
     elif data == "RCP":
         nyears = 600
     Pk = nevent/(season_days*nyears)
-    print(f"{data}: season_days: {season_days}, nyears: {nyears}, nevent: {nevent}")
+    InstrumentFunctions.log(f"{data}: season_days: {season_days}, nyears: {nyears}, nevent: {nevent}")
     return Pk, season_days
 
-def curve_y(data, region, season, nevent):
-    phi, _ = load_phi(data, region, season)
+@InstrumentFunctions.instrumented
+def curve_y(data, region, season, nevent, phi=None):
+    if phi is None:
+        phi, _ = load_phi(data, region, season)
     Pk, season_days = calculate_Pk(data, season, nevent)
     x = np.arange(season_days)
-    P = (1-phi**(x))*Pk
-    y = P * ((1 - P) ** (x - 1))
-    y /= y.sum()
-    max_x = np.where(y==np.max(y))[0][0]
-    print(f"{region} {season}: φ: {phi:.2g}, α: {Pk:.2g}, max: {max_x}")
+    y = CurveFunctions.recurrence_curve(phi, Pk, x)
+    max_x = int(CurveFunctions.curve_moments(y, x)['mode'])
+    InstrumentFunctions.log(f"{region} {season}: φ: {phi:.2g}, α: {Pk:.2g}, max: {max_x}")
     return y, max_x, season_days, phi, Pk
 
+@InstrumentFunctions.instrumented
 def Plotting_with_theo_curve(region, region_name, season):
+    cube = HistogramFunctions.load_cube()
 
     ## CESM1 Pre-industrial Control Run
-    folder = f"{basepath}/data/CESM1/BlockingEvents/ReturnPeriods/Hist"
-    ds_Hist = xr.open_dataset(f"{folder}/{region}_{season}.nc")
-    y_Hist, max_x_Hist, season_days, phi_Hist, Pk_Hist = curve_y("Hist", region, season, ds_Hist.event.shape[0])
-    Return_Hist = ds_Hist.return_period.values[ds_Hist.return_period.values <= season_days]
-    nblock_Hist = ds_Hist.event.shape[0]*100/1799
+    _, _, nevent_Hist = HistogramFunctions.histogram(cube, "CESM1-Hist", region, season)
+    y_Hist, max_x_Hist, season_days, phi_Hist, Pk_Hist = curve_y("Hist", region, season, nevent_Hist)
+    _, Count_Hist, _ = HistogramFunctions.histogram(cube, "CESM1-Hist", region, season, max_days=season_days)
+    nblock_Hist = nevent_Hist*100/1799
 
     ## CESM1 RCP 8.5 Run
-    folder = f"{basepath}/data/CESM1/BlockingEvents/ReturnPeriods/RCP"
-    ds_RCP = xr.open_dataset(f"{folder}/{region}_{season}.nc")
-    y_RCP, max_x_RCP, season_days, phi_RCP, Pk_RCP = curve_y("RCP", region, season, ds_RCP.event.shape[0])
-    Return_RCP = ds_RCP.return_period.values[ds_RCP.return_period.values<=season_days]
-    nblock_RCP = ds_RCP.event.shape[0]*100/600
+    _, _, nevent_RCP = HistogramFunctions.histogram(cube, "CESM1-RCP", region, season)
+    y_RCP, max_x_RCP, season_days, phi_RCP, Pk_RCP = curve_y("RCP", region, season, nevent_RCP)
+    _, Count_RCP, _ = HistogramFunctions.histogram(cube, "CESM1-RCP", region, season, max_days=season_days)
+    nblock_RCP = nevent_RCP*100/600
     
+    Draw_with_theo_curve(Count_Hist, y_Hist, phi_Hist, Pk_Hist, Count_RCP, y_RCP, phi_RCP, Pk_RCP,
+                         season_days, region_name, season, f"{Savingpath}/{region}_{season}.png")
+
+@InstrumentFunctions.instrumented
+def Draw_with_theo_curve(Count_Hist, y_Hist, phi_Hist, Pk_Hist, Count_RCP, y_RCP, phi_RCP, Pk_RCP,
+                         season_days, region_name, season, savefile):
+    '''Count_Hist, Count_RCP: return-period counts for 0..season_days days, as from HistogramFunctions'''
     x = np.arange(season_days)
 
     ## Plot Density Function
@@ -77,14 +85,14 @@ def Plotting_with_theo_curve(region, region_name, season):
     
     # CESM1 Pre-industrial Control Run
     c1, c2 = 'darkseagreen', 'darkorange'
-    BIN_Hist=np.arange(season_days)
-    sns.histplot(Return_Hist, bins=BIN_Hist, stat='density', kde = False, color=c1, alpha = 0.7)
+    BIN_Hist=np.arange(season_days).tolist() # a list, seaborn compares bins to 'auto' when weights are given
+    sns.histplot(x=np.arange(len(Count_Hist)), weights=Count_Hist, bins=BIN_Hist, stat='density', kde = False, color=c1, alpha = 0.7)
     Hist_curve, = plt.plot(x, y_Hist, color=c1, linewidth=2,
             label=fr"Predicted recurrence for CTRL run, φ, α = {phi_Hist:.2g}, {Pk_Hist:.2g}")
 
     # CESM1 LENS RCP8.5 Run
-    BIN_RCP=np.arange(season_days)
-    sns.histplot(Return_RCP, bins=BIN_RCP,  stat='density', kde = False, color = c2, alpha = 0.5)
+    BIN_RCP=np.arange(season_days).tolist()
+    sns.histplot(x=np.arange(len(Count_RCP)), weights=Count_RCP, bins=BIN_RCP, stat='density', kde = False, color = c2, alpha = 0.5)
     RCP_curve, = plt.plot(x, y_RCP, color='orange', linewidth=2,
             label=fr"Predicted recurrence for RCP 8.5 run, φ, α = {phi_RCP:.2g}, {Pk_RCP:.2g}")
     
@@ -102,14 +110,20 @@ def Plotting_with_theo_curve(region, region_name, season):
     plt.ylabel('Probability Density', fontsize=12)
 
     plt.tight_layout(pad = 1)
-    plt.savefig(f"{Savingpath}/{region}_{season}.png",dpi=600)
+    plt.savefig(savefile,dpi=600)
 
 #%%
 region_list = ["Pacific", "Atlantic", "BAM"]
 region_names = ["Northern Pacific", "Northern Atlantic", "Southern Pacific"]
 season_list = ["DJF", "JJA"]
 
-for season in season_list:
-    for region, region_name in zip(region_list, region_names):
-        Return_CESM = Plotting_with_theo_curve(region, region_name, season)
+def figure_jobs():
+    return [RenderFunctions.with_files(RenderFunctions.job(f"CESM_Hist {region} {season}", "CESM_Hist",
+                                                           "Plotting_with_theo_curve", region, region_name, season),
+                                       [f"{basepath}/data/CESM1/regional_lwa/{data}/{region}_{season}.nc" for data in ["Hist", "RCP"]])
+            for season in season_list for region, region_name in zip(region_list, region_names)]
+
+if __name__ == "__main__":
+    HistogramFunctions.load_cube()  # build or refresh the cube once, before the jobs load it
+    RenderFunctions.run_jobs(figure_jobs())
 
@@ -0,0 +1,218 @@
+'''
+Incremental catalog code: append new ERA5 seasons to a ReturnPeriods catalog without re-detecting the record
+'''
+import os
+import glob
+import numpy as np
+import xarray as xr
+import BlockingDetectionFunctions
+import CompositeFunctions
+import EventDetectionFunctions
+import FitFunctions
+import InstrumentFunctions
+import SensitivityFunctions
+
+basepath = os.path.expanduser("~/Github")
+catalog_folder = f"{basepath}/data/ERA5/BlockingEvents/ReturnPeriods"
+lwa_folder = f"{basepath}/data/ERA5"
+
+def catalog_state(ds):
+    """
+    Running counts of a catalog, enough to append a season without its earlier events
+
+    Returns:
+    --------
+    dict
+        'nevent', 'ndays', 'head' days before the first onset and 'tail' days after the
+        last distinct onset (-1 without onsets), and 'duration' Welford accumulator of durations
+    """
+    onset_mask, _, _ = BlockingDetectionFunctions.map_events_to_timeline(ds['time'].values, ds['start_date'].values)
+    onsets = np.flatnonzero(onset_mask)
+    ndays = len(onset_mask)
+    return {
+        'nevent': int(ds.sizes['event']),
+        'ndays': ndays,
+        'head': int(onsets[0]) if len(onsets) else -1,
+        'tail': ndays - 1 - int(onsets[-1]) if len(onsets) else -1,
+        'duration': CompositeFunctions.welford_batch(ds['duration'].values.astype(float)),
+    }
+
+STATE_KEYS = ('nevent', 'ndays', 'head', 'tail')
+DURATION_KEYS = ('n', 'mean', 'M2')
+
+def state_attrs(state):
+    '''catalog attributes state_* holding a running state, written by update_catalog'''
+    attrs = {f"state_{key}": int(state[key]) for key in STATE_KEYS}
+    attrs.update({f"state_duration_{key}": float(state['duration'][key]) for key in DURATION_KEYS})
+    return attrs
+
+def saved_state(ds):
+    '''running state from the catalog attributes, rebuilt by catalog_state when missing or out of date'''
+    attrs = ds.attrs
+    names = [f"state_{key}" for key in STATE_KEYS] + [f"state_duration_{key}" for key in DURATION_KEYS]
+    if any(name not in attrs for name in names) or \
+            attrs['state_nevent'] != ds.sizes['event'] or attrs['state_ndays'] != ds.sizes['time']:
+        return catalog_state(ds)
+    state = {key: int(attrs[f"state_{key}"]) for key in STATE_KEYS}
+    state['duration'] = {key: np.float64(attrs[f"state_duration_{key}"]) for key in DURATION_KEYS}
+    return state
+
+def append_season(ds, new, state=None):
+    """
+    Append the catalog of one new season to a catalog and update its statistics
+
+    The timeline of a catalog runs over its season days back to back, so the one
+    return period that changes is the gap from the last old onset to the first new one.
+    Counts, α and the duration mean and variance are updated from the running state;
+    the median duration and the KDE recurrence need the full sample and are recomputed.
+
+    Parameters:
+    -----------
+    ds : xarray.Dataset
+        Catalog in the ReturnPeriods layout
+    new : xarray.Dataset
+        Catalog of the new season(s), e.g. detect_events on the new LWA file
+    state : dict, optional
+        catalog_state(ds), computed when not given
+
+    Returns:
+    --------
+    xarray.Dataset, dict
+        Updated catalog and its state
+    """
+    state = catalog_state(ds) if state is None else state
+    new_state = catalog_state(new)
+    old_days = BlockingDetectionFunctions.day_numbers(ds['time'].values[-1:])
+    new_days = BlockingDetectionFunctions.day_numbers(new['time'].values[:1])
+    if len(old_days) and len(new_days) and new_days[0] <= old_days[0]:
+        raise ValueError("new season must start after the last day of the catalog")
+
+    # Gap across the seasons: days after the last old onset plus days before the first new one
+    crossing = [state['tail'] + new_state['head']] if state['tail'] >= 0 and new_state['head'] >= 0 else []
+    return_period = np.concatenate([ds['return_period'].values, np.array(crossing, dtype=int), new['return_period'].values])
+
+    tail = new_state['tail'] if new_state['tail'] >= 0 else (state['tail'] + new_state['ndays'] if state['tail'] >= 0 else -1)
+    head = state['head'] if state['head'] >= 0 else (state['ndays'] + new_state['head'] if new_state['head'] >= 0 else -1)
+    state = {
+        'nevent': state['nevent'] + new_state['nevent'],
+        'ndays': state['ndays'] + new_state['ndays'],
+        'head': head,
+        'tail': tail,
+        'duration': CompositeFunctions.welford_merge(state['duration'], new_state['duration']),
+    }
+
+    # Variables off the event, interval and time dims (threshold, the stored fit) carry over
+    events = ['start_date', 'event_lon', 'event_lat', 'duration']
+    merged = ds.drop_dims(['event', 'interval', 'time'], errors='ignore')
+    for name in events:
+        if name in ds:
+            merged[name] = ('event', np.concatenate([ds[name].values, new[name].values]))
+    merged = merged.assign_coords(time=np.concatenate([ds['time'].values, new['time'].values]))
+    merged['return_period'] = ('interval', return_period)
+    mean, var = CompositeFunctions.welford_finalize(state['duration'])
+    recurrence = BlockingDetectionFunctions.kde(return_period)
+    merged['duration_mean'] = float(mean)
+    merged['duration_var'] = float(var)
+    merged['duration_median'] = np.median(merged['duration'].values) if state['nevent'] else np.nan
+    merged['recurrence'] = np.nan if recurrence is None else recurrence
+    merged['alpha'] = state['nevent'] / max(state['ndays'], 1)
+    return merged, state
+
+def refit(ds, season, x0=None):
+    '''φ, α and negative log-likelihood of a catalog, warm-started from the previous fit when given'''
+    season_days = BlockingDetectionFunctions.season_length(season)
+    counts, support = FitFunctions.return_period_counts([ds['return_period'].values], season_days)
+    if x0 is None and 'phi' in ds and 'alpha_fit' in ds:
+        x0 = (np.atleast_1d(ds['phi'].values), np.atleast_1d(ds['alpha_fit'].values))
+    phi, alpha, nll = FitFunctions.fit_curves(counts, support, x0=x0)
+    return phi[0], alpha[0], nll[0]
+
+def base_threshold(paths, region, season, percentile=90):
+    '''(nlon,) percentile of band-mean LWA over the season days of several files, as percentile_threshold over one'''
+    box = BlockingDetectionFunctions.Region_ERA(f"{region} {season}")
+    band = [chunk[2] for path in paths
+            for chunk in SensitivityFunctions.band_chunks(path, SensitivityFunctions.season_axis(path, season, box[2], box[3]))]
+    return np.percentile(np.concatenate(band), percentile, axis=0)
+
+@InstrumentFunctions.instrumented
+def update_catalog(catalog_path, lwa_paths, region, season, threshold=None, base_paths=None, fit=True, **detect_kwargs):
+    """
+    Detect events in new season files and append them to a ReturnPeriods catalog in place
+
+    Only the new seasons are read and tracked, against the catalog's fixed per-longitude
+    threshold, so one refresh costs one season of detection. The threshold and the running
+    state (catalog_state) are stored in the catalog, so the next refresh reads neither the
+    base period nor, unless the catalog was changed elsewhere, all of its events.
+
+    Parameters:
+    -----------
+    catalog_path : str
+        ReturnPeriods catalog {region}_{season}.nc
+    lwa_paths : str or list of str
+        LWA files of the new seasons, e.g. LWA_{region}_{season}_{YEAR}.nc, in time order
+    threshold : np.ndarray, optional
+        (nlon,) climatological threshold, e.g. percentile_threshold over the base period;
+        defaults to the one stored in the catalog by an earlier update
+    base_paths : list of str, optional
+        LWA files of the catalog's seasons, to compute the threshold on the first update of
+        a catalog without one (base_threshold)
+    fit : bool, default=True
+        Refit φ and α, warm-started from the stored fit
+
+    Returns:
+    --------
+    xarray.Dataset
+        The updated catalog, also written back to catalog_path
+    """
+    with xr.open_dataset(catalog_path) as f:
+        ds = f.load()
+    kwargs = {'percentile': ds.attrs.get('percentile', 90), 'min_duration': ds.attrs.get('min_duration', 5)}
+    kwargs.update(detect_kwargs)
+    if threshold is None and 'threshold' in ds:
+        threshold = ds['threshold'].values
+    elif threshold is None:
+        if not base_paths:
+            raise ValueError("catalog has no stored threshold, pass threshold or the base-period base_paths")
+        threshold = base_threshold(base_paths, region, season, kwargs['percentile'])
+        InstrumentFunctions.log(f"{region} {season}: threshold from {len(base_paths)} base-period files")
+
+    state = saved_state(ds)
+    for path in [lwa_paths] if isinstance(lwa_paths, str) else lwa_paths:
+        new = EventDetectionFunctions.detect_events(path, region, season, threshold=threshold, **kwargs)
+        ds, state = append_season(ds, new, state)
+        InstrumentFunctions.log(f"{region} {season}: +{new.sizes['event']} events from {os.path.basename(path)}")
+    ds['threshold'] = ('lon', np.asarray(threshold))
+    ds.attrs.update(state_attrs(state))
+    if fit:
+        phi, alpha, nll = refit(ds, season)
+        ds['phi'], ds['alpha_fit'], ds['nll'] = phi, alpha, nll
+
+    # Write next to the catalog and swap it in, so readers never see a partial file
+    tmp = f"{catalog_path}.tmp"
+    ds.to_netcdf(tmp)
+    os.replace(tmp, catalog_path)
+    return ds
+
+def _season_year(path):
+    return int(os.path.splitext(path)[0].rsplit('_', 1)[1])
+
+def season_files(catalog_path, region, season, folder=lwa_folder):
+    '''LWA_{region}_{season}_{YEAR}.nc files of the seasons in the catalog and of the seasons after its last day'''
+    with xr.open_dataset(catalog_path) as ds:
+        last = BlockingDetectionFunctions.calendar_fields(ds['time'].values[-1:])['year'][0]
+    # DJF belongs to the December year, so its last day is in the year after the season year
+    last = last - 1 if season == "DJF" else last
+    files = sorted(glob.glob(f"{folder}/LWA_{region}_{season}_*.nc"), key=_season_year)
+    return [f for f in files if _season_year(f) <= last], [f for f in files if _season_year(f) > last]
+
+def new_season_files(catalog_path, region, season, folder=lwa_folder):
+    '''LWA_{region}_{season}_{YEAR}.nc files of seasons after the last day of the catalog'''
+    return season_files(catalog_path, region, season, folder)[1]
+
+if __name__ == "__main__":
+    for region in ["Atlantic", "Pacific"]:
+        for season in ["DJF", "JJA"]:
+            catalog_path = f"{catalog_folder}/{region}_{season}.nc"
+            base, files = season_files(catalog_path, region, season)
+            if files:
+                update_catalog(catalog_path, files, region, season, base_paths=base)
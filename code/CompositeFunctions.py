@@ -0,0 +1,383 @@
+'''
+Composite code: streaming lag by relative-longitude composites of LWA and flux around blocking onsets
+'''
+import os
+import numpy as np
+import xarray as xr
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import BlockingDetectionFunctions
+import DataAccessFunctions
+import EventDetectionFunctions
+import SignificanceFunctions
+import InstrumentFunctions
+
+LWA_KINDS = ("Current", "Next", "Previous")
+
+_shared = {}  # band-mean field of the bootstrap workers, attached from shared memory
+
+def welford_init(shape):
+    '''empty accumulator of per-cell count, mean and sum of squared deviations'''
+    return {'n': np.zeros(shape), 'mean': np.zeros(shape), 'M2': np.zeros(shape)}
+
+def welford_batch(samples):
+    '''accumulator of a (nsample, ...) batch, NaN samples are skipped'''
+    valid = np.isfinite(samples)
+    n = valid.sum(axis=0).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, np.nansum(samples, axis=0) / n, 0)
+    M2 = np.nansum((samples - mean)**2, axis=0)
+    return {'n': n, 'mean': mean, 'M2': M2}
+
+def welford_merge(a, b):
+    '''combine two accumulators (Chan et al. pairwise update), order does not matter'''
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(n > 0, b['n'] / n, 0)
+    return {'n': n, 'mean': a['mean'] + delta * frac, 'M2': a['M2'] + b['M2'] + delta**2 * a['n'] * frac}
+
+def welford_finalize(acc, ddof=1):
+    '''mean and variance of an accumulator, variance is NaN where n <= ddof'''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = np.where(acc['n'] > ddof, acc['M2'] / (acc['n'] - ddof), np.nan)
+    return acc['mean'], var
+
+def event_windows(days, event_index, lon_index, nlon, max_lag=20, half_width=30):
+    """
+    Time rows and longitude columns of the lag by relative-longitude window of each event
+
+    Longitudes wrap across the dateline. A lag is valid only if the time axis holds
+    the day exactly that many days from the onset, so windows never run across
+    missing days or season gaps.
+
+    Returns:
+    --------
+    rows, valid : np.ndarray
+        (nevent, 2*max_lag+1) time indices and bool
+    cols : np.ndarray
+        (nevent, 2*half_width+1) longitude indices
+    """
+    lags = np.arange(-max_lag, max_lag + 1)
+    rows = event_index[:, None] + lags
+    inside = (rows >= 0) & (rows < len(days))
+    rows = np.clip(rows, 0, len(days) - 1)
+    valid = inside & (days[rows] - days[event_index][:, None] == lags)
+    cols = (lon_index[:, None] + np.arange(-half_width, half_width + 1)) % nlon
+    return rows, valid, cols
+
+def event_activity(onset_days, duration, max_lag=20):
+    """
+    Whether the current, next and previous event is blocking at each lag of each event's window
+
+    Returns:
+    --------
+    dict
+        'Current', 'Next', 'Previous' -> (nevent, 2*max_lag+1) float 0/1
+    """
+    lags = np.arange(-max_lag, max_lag + 1)
+    day = onset_days[:, None] + lags
+    nevent = len(onset_days)
+    active = {'Current': (lags >= 0) & (lags < duration[:, None])}
+    for kind, shift in (("Next", 1), ("Previous", -1)):
+        other = np.clip(np.arange(nevent) + shift, 0, max(nevent - 1, 0))
+        exists = (np.arange(nevent) + shift >= 0) & (np.arange(nevent) + shift < nevent)
+        start = onset_days[other][:, None]
+        active[kind] = exists[:, None] & (day >= start) & (day < start + duration[other][:, None])
+    return {kind: mask.astype(float) for kind, mask in active.items()}
+
+def nearest_lon_index(lon, event_lon):
+    '''grid index of the closest longitude, distance measured around the circle'''
+    distance = np.abs((np.asarray(event_lon)[:, None] - np.asarray(lon)[None, :] + 180) % 360 - 180)
+    return np.argmin(distance, axis=1)
+
+def _accumulate(job):
+    '''one worker: accumulators of a group of consecutive events for every field'''
+    acc = {}
+    for name, (path, var_name) in job['fields'].items():
+        ds = DataAccessFunctions.open_dataset(path)
+        times = ds[job['time_name']].values
+        days = BlockingDetectionFunctions.day_numbers(times)
+        lat = ds[job['lat_name']].values
+        lat_index = EventDetectionFunctions.lat_band_index(lat, job['Lat1'], job['Lat2'])
+        lon = ds[job['lon_name']].values
+        _, event_index, _ = BlockingDetectionFunctions.map_events_to_timeline(times, job['start_date'])
+        # Onsets missing from this file's time axis map to the nearest day; they add no samples
+        exact = days[event_index] == BlockingDetectionFunctions.day_numbers(job['start_date'])
+        lon_index = nearest_lon_index(lon, job['event_lon'])
+        kinds = LWA_KINDS if name == "LWA" else (name,)
+
+        for start in range(0, len(event_index), job['batch_size']):
+            batch = slice(start, start + job['batch_size'])
+            rows, valid, cols = event_windows(days, event_index[batch], lon_index[batch], len(lon),
+                                              job['max_lag'], job['half_width'])
+            valid &= exact[batch][:, None]
+            # Read only the days these windows touch, then reduce to the band mean
+            needed, inverse = np.unique(rows, return_inverse=True)
+            field = ds[var_name].isel({job['time_name']: needed, job['lat_name']: lat_index})
+            band = field.transpose(job['time_name'], job['lat_name'], job['lon_name']).values.mean(axis=1)
+            windows = band[inverse.reshape(rows.shape)[:, :, None], cols[:, None, :]]
+            windows[~valid] = np.nan
+
+            for kind in kinds:
+                samples = windows * job['activity'][kind][batch][:, :, None] if kind in LWA_KINDS else windows
+                acc[kind] = welford_merge(acc.get(kind, welford_init(windows.shape[1:])), welford_batch(samples))
+    return acc
+
+@InstrumentFunctions.instrumented
+def build_composites(catalog_path, fields, region, season, Folder=None, max_lag=20, half_width=30,
+                     batch_size=64, max_workers=None, box=None,
+                     time_name="time", lat_name="lat", lon_name="lon"):
+    """
+    Composite Hovmöller diagrams around blocking onsets, streamed event by event
+
+    Each event contributes its band-mean window of 2*max_lag+1 days by 2*half_width+1
+    longitudes centered on its onset. Current, Next and Previous are the LWA windows
+    while the event itself, the following event or the preceding event of the catalog
+    is blocking (zero otherwise); other fields, e.g. Flux, are plain window means. Means
+    and variances are kept in Welford accumulators, merged across worker processes, so
+    only batch_size windows are in memory per worker.
+
+    Parameters:
+    -----------
+    catalog_path : str
+        Event catalog with start_date, event_lon, duration
+    fields : dict
+        Field name -> (NetCDF path, variable), 'LWA' gives Current/Next/Previous,
+        e.g. {'LWA': (lwa_path, 'LWA'), 'Flux': (flux_path, 'F')}
+    region, season : str
+        e.g. "Atlantic", "DJF"
+    Folder : str, optional
+        Where to write {kind}_{region}_{season}.npy (mean, as read by Comp_LWA.load_data),
+        {kind}Var_{region}_{season}.npy (variance) and Count_{region}_{season}.npy
+    max_workers : int, optional
+        Worker processes; 1 runs in this process
+
+    Returns:
+    --------
+    dict
+        kind -> (mean, variance), each (2*max_lag+1, 2*half_width+1)
+    """
+    box = BlockingDetectionFunctions.Region_ERA(f"{region} {season}") if box is None else np.asarray(box)
+    with xr.open_dataset(catalog_path) as catalog:
+        order = np.argsort(BlockingDetectionFunctions.day_numbers(catalog['start_date'].values), kind='stable')
+        start_date = catalog['start_date'].values[order]
+        event_lon = catalog['event_lon'].values[order]
+        duration = catalog['duration'].values[order]
+    activity = event_activity(BlockingDetectionFunctions.day_numbers(start_date), duration, max_lag)
+
+    # Consecutive event groups, one per worker, so each reads a compact span of days
+    ngroup = 1 if max_workers == 1 else max(1, min(len(start_date), max_workers or os.cpu_count() or 1))
+    bounds = np.linspace(0, len(start_date), ngroup + 1).astype(int)
+    jobs = [{'fields': fields, 'start_date': start_date[b:e], 'event_lon': event_lon[b:e],
+             'activity': {kind: mask[b:e] for kind, mask in activity.items()},
+             'Lat1': box[2], 'Lat2': box[3], 'max_lag': max_lag, 'half_width': half_width, 'batch_size': batch_size,
+             'time_name': time_name, 'lat_name': lat_name, 'lon_name': lon_name}
+            for b, e in zip(bounds[:-1], bounds[1:])]
+
+    if max_workers == 1:
+        parts = [_accumulate(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            parts = list(pool.map(_accumulate, jobs))
+
+    acc = parts[0]
+    for part in parts[1:]:
+        acc = {kind: welford_merge(acc[kind], part[kind]) for kind in acc}
+    composites = {kind: welford_finalize(a) for kind, a in acc.items()}
+
+    if Folder is not None:
+        os.makedirs(Folder, exist_ok=True)
+        for kind, (mean, var) in composites.items():
+            np.save(f"{Folder}/{kind}_{region}_{season}.npy", mean)
+            np.save(f"{Folder}/{kind}Var_{region}_{season}.npy", var)
+        if "Current" in acc:
+            np.save(f"{Folder}/Count_{region}_{season}.npy", acc["Current"]['n'])
+    return composites
+
+def band_mean_field(path, var_name, Lat1, Lat2, time_chunk=365, dtype=np.float32, out=None,
+                    time_name="time", lat_name="lat", lon_name="lon"):
+    """
+    (time, lon) latitude-band mean of a field, read time_chunk days at a time
+
+    Returns:
+    --------
+    band : np.ndarray
+        Band mean, written into out when given (e.g. a shared-memory buffer)
+    days, lon : np.ndarray
+        Day numbers of the time axis and longitudes
+    """
+    ds = DataAccessFunctions.open_dataset(path)
+    lat_index = EventDetectionFunctions.lat_band_index(ds[lat_name].values, Lat1, Lat2)
+    ntime, nlon = ds.sizes[time_name], ds.sizes[lon_name]
+    band = np.empty((ntime, nlon), dtype=dtype) if out is None else out
+    for start in range(0, ntime, time_chunk):
+        rows = slice(start, min(start + time_chunk, ntime))
+        field = ds[var_name].isel({time_name: rows, lat_name: lat_index})
+        band[rows] = field.transpose(time_name, lat_name, lon_name).values.mean(axis=1)
+    return band, BlockingDetectionFunctions.day_numbers(ds[time_name].values), ds[lon_name].values
+
+def window_composites(band, days, event_index, lon_index, activity, max_lag=20, half_width=30):
+    """
+    Current/Next/Previous composites of one or many sets of onsets, vectorized over sets
+
+    Parameters:
+    -----------
+    band : np.ndarray
+        (time, lon) band-mean LWA
+    event_index : np.ndarray
+        (..., nevent) time indices of onsets, -1 for an onset left out
+    lon_index : np.ndarray
+        (nevent,) onset longitude indices
+    activity : dict
+        From event_activity
+
+    Returns:
+    --------
+    dict
+        kind -> (..., 2*max_lag+1, 2*half_width+1) mean over onsets
+    """
+    lead = event_index.shape[:-1]
+    flat = event_index.reshape(-1)
+    lons = np.broadcast_to(lon_index, event_index.shape).reshape(-1)
+    rows, valid, cols = event_windows(days, np.maximum(flat, 0), lons, band.shape[1], max_lag, half_width)
+    valid &= (flat >= 0)[:, None]
+    windows = band[rows[:, :, None], cols[:, None, :]].astype(float)
+    windows[~valid] = np.nan
+    windows = windows.reshape(lead + event_index.shape[-1:] + windows.shape[1:])
+    with np.errstate(invalid='ignore'):
+        return {kind: np.nanmean(windows * activity[kind][:, :, None], axis=-3) for kind in LWA_KINDS}
+
+def _attach(name, shape, dtype):
+    '''bootstrap worker initializer: map the shared band-mean field'''
+    shm = shared_memory.SharedMemory(name=name)
+    _shared['shm'] = shm
+    _shared['band'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _null_exceedances(job):
+    '''one task: resample pseudo-onsets, count null composites at or above and at or below the observed ones'''
+    band = _shared['band']
+    rng = np.random.default_rng(job['seed'])
+    starts, lengths = job['season_start'], job['season_length']
+    ge = {kind: np.zeros(obs.shape) for kind, obs in job['observed'].items()}
+    le = {kind: np.zeros(obs.shape) for kind, obs in job['observed'].items()}
+
+    done = 0
+    while done < job['nresample']:
+        nbatch = min(job['batch'], job['nresample'] - done)
+        # Whole seasons are the bootstrap blocks: every event of a season moves to the same drawn season
+        drawn = rng.integers(len(starts), size=(nbatch, job['nseason']))[:, job['event_season']]
+        index = np.where(job['offset'] < lengths[drawn], starts[drawn] + job['offset'], -1)
+        null = window_composites(band, job['days'], index, job['lon_index'], job['activity'],
+                                 job['max_lag'], job['half_width'])
+        for kind, obs in job['observed'].items():
+            ge[kind] += np.sum(null[kind] >= obs, axis=0)
+            le[kind] += np.sum(null[kind] <= obs, axis=0)
+        done += nbatch
+    return ge, le
+
+@InstrumentFunctions.instrumented
+def bootstrap_significance(catalog_path, lwa_path, region, season, nresample=1000, q=0.05, alternative='greater',
+                           max_lag=20, half_width=30, var_name="LWA", box=None, seed=0,
+                           max_workers=None, resamples_per_task=50, max_batch_values=2e7):
+    """
+    Field significance of Current/Next/Previous composites against pseudo-onset nulls
+
+    Null composites keep each event's day within its season, onset longitude and
+    duration, but move all events of a season together to a season year drawn with
+    replacement (a block bootstrap with seasons as blocks), so the clustering and
+    autocorrelation of events within a season are preserved. The band-mean LWA is put
+    in shared memory once and resampled on a process pool, one SeedSequence child per
+    task. Per-pixel p-values are controlled for the false discovery rate at q
+    (Benjamini-Hochberg) within each composite.
+
+    Parameters:
+    -----------
+    catalog_path, lwa_path : str
+        Event catalog (start_date, event_lon, duration) and LWA NetCDF file on a sorted time axis
+    nresample : int, default=1000
+        Number of null composites
+    alternative : str, default='greater'
+        'greater', 'less' or 'two-sided'
+    max_workers : int, optional
+        Worker processes; 1 runs in this process
+    max_batch_values : float, default=2e7
+        Window values held at once per worker, sets how many resamples are vectorized together
+
+    Returns:
+    --------
+    dict
+        kind -> (p_values, significant), each (2*max_lag+1, 2*half_width+1)
+    """
+    if alternative not in ('greater', 'less', 'two-sided'):
+        raise ValueError("Invalid alternative. Choose 'greater', 'less' or 'two-sided'.")
+    box = BlockingDetectionFunctions.Region_ERA(f"{region} {season}") if box is None else np.asarray(box)
+    with xr.open_dataset(catalog_path) as catalog:
+        start_date = catalog['start_date'].values
+        event_lon = catalog['event_lon'].values
+        duration = catalog['duration'].values
+    order = np.argsort(BlockingDetectionFunctions.day_numbers(start_date), kind='stable')
+    start_date, event_lon, duration = start_date[order], event_lon[order], duration[order]
+
+    ds = DataAccessFunctions.open_dataset(lwa_path)
+    times = ds['time'].values
+    ranges = BlockingDetectionFunctions.season_ranges(times, season)
+    if any(not isinstance(r, slice) for r in ranges.values()):
+        raise ValueError("LWA time axis must be sorted")
+    season_start = np.array([r.start for r in ranges.values()])
+    season_length = np.array([r.stop - r.start for r in ranges.values()])
+
+    # Onsets on the LWA time axis, as season block and day within the season; onsets the
+    # axis does not hold (mapped to the nearest day) are left out
+    _, event_index, _ = BlockingDetectionFunctions.map_events_to_timeline(times, start_date)
+    exact = BlockingDetectionFunctions.day_numbers(times)[event_index] == BlockingDetectionFunctions.day_numbers(start_date)
+    block = np.maximum(np.searchsorted(season_start, event_index, side='right') - 1, 0)
+    inside = exact & (event_index >= season_start[block]) & (event_index - season_start[block] < season_length[block])
+    event_index, block = event_index[inside], block[inside]
+    offset = event_index - season_start[block]
+    seasons, event_season = np.unique(block, return_inverse=True)
+    activity = event_activity(BlockingDetectionFunctions.day_numbers(start_date[inside]), duration[inside], max_lag)
+
+    shape = (ds.sizes['time'], ds.sizes['lon'])
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float32).itemsize)
+    band = None
+    try:
+        band = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        _, days, lon = band_mean_field(lwa_path, var_name, box[2], box[3], out=band)
+        lon_index = nearest_lon_index(lon, event_lon[inside])
+        observed = window_composites(band, days, event_index, lon_index, activity, max_lag, half_width)
+
+        window_values = max(len(event_index), 1) * (2*max_lag + 1) * (2*half_width + 1)
+        ntask = int(np.ceil(nresample / resamples_per_task))
+        common = {'days': days, 'season_start': season_start, 'season_length': season_length,
+                  'nseason': len(seasons), 'event_season': event_season, 'offset': offset, 'lon_index': lon_index,
+                  'activity': activity, 'observed': observed, 'max_lag': max_lag, 'half_width': half_width,
+                  'batch': max(1, int(max_batch_values // window_values))}
+        jobs = [dict(common, seed=s, nresample=min(resamples_per_task, nresample - i*resamples_per_task))
+                for i, s in enumerate(np.random.SeedSequence(seed).spawn(ntask))]
+
+        if max_workers == 1:
+            _shared['band'] = band
+            parts = [_null_exceedances(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach,
+                                     initargs=(shm.name, shape, np.float32)) as pool:
+                parts = list(pool.map(_null_exceedances, jobs))
+    finally:
+        _shared.clear()
+        band = None  # drop the view so the segment can close
+        shm.close()
+        shm.unlink()
+
+    results = {}
+    for kind in LWA_KINDS:
+        p_greater = (1 + sum(ge[kind] for ge, _ in parts)) / (1 + nresample)
+        p_less = (1 + sum(le[kind] for _, le in parts)) / (1 + nresample)
+        if alternative == 'greater':
+            p_values = p_greater
+        elif alternative == 'less':
+            p_values = p_less
+        else:
+            p_values = np.minimum(1, 2 * np.minimum(p_greater, p_less))
+        results[kind] = (p_values, SignificanceFunctions.fdr_bh(p_values, q))
+    return results
@@ -0,0 +1,149 @@
+'''
+Theoretical recurrence curve code
+P = (1-φ^x)α; y = P(1-P)^(x-1), α denoted as Pk in the figure scripts
+'''
+import os
+import numpy as np
+
+def recurrence_curve(phi, alpha, x):
+    """
+    Normalized theoretical recurrence curve, broadcast over φ and α
+
+    Parameters:
+    -----------
+    phi, alpha : float or np.ndarray
+        Temporal correlation and onset probability, broadcast against each other
+    x : np.ndarray
+        1D return-period axis (day)
+
+    Returns:
+    --------
+    np.ndarray
+        Curves of shape broadcast(phi, alpha) + (len(x),), each summing to 1 over x
+    """
+    phi = np.asarray(phi, dtype=float)[..., None]
+    alpha = np.asarray(alpha, dtype=float)[..., None]
+    x = np.asarray(x)
+
+    P = (1 - phi**x) * alpha
+    y = P * ((1 - P) ** (x - 1))
+    y /= y.sum(axis=-1, keepdims=True)
+    return y
+
+def curve_moments(y, x):
+    """
+    Mode, mean and SD of normalized curves along the last axis
+
+    Returns:
+    --------
+    dict
+        'mode' : x at the curve maximum (first one on ties)
+        'mode_refined' : mode refined by a parabola through the maximum and its neighbours
+        'mean', 'sd' : first two moments of the curve over x
+    """
+    x = np.asarray(x, dtype=float)
+    max_idx = np.argmax(y, axis=-1)
+    mode = x[max_idx]
+
+    k = np.clip(max_idx, 1, len(x) - 2)[..., None]
+    y0, y1, y2 = (np.take_along_axis(y, k + d, axis=-1)[..., 0] for d in (-1, 0, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = 0.5 * (y0 - y2) / (y0 - 2*y1 + y2)
+    shift = np.where(np.isfinite(shift) & (np.abs(shift) <= 1), shift, 0)
+    mode_refined = x[k[..., 0]] + shift * (x[1] - x[0])
+
+    mean = np.sum(x * y, axis=-1)
+    sd = np.sqrt(np.sum(y * (x - mean[..., None])**2, axis=-1))
+    return {'mode': mode, 'mode_refined': mode_refined, 'mean': mean, 'sd': sd}
+
+def curve_surfaces(phis, alphas, x, chunk=16):
+    '''mode, mean and SD surfaces on the (φ, α) grid, computed chunk rows of φ at a time'''
+    phis, alphas = np.asarray(phis, dtype=float), np.asarray(alphas, dtype=float)
+    surfaces = {key: np.empty((len(phis), len(alphas))) for key in ('mode', 'mode_refined', 'mean', 'sd')}
+    for start in range(0, len(phis), chunk):
+        rows = slice(start, start + chunk)
+        y = recurrence_curve(phis[rows, None], alphas[None, :], x)
+        for key, value in curve_moments(y, x).items():
+            surfaces[key][rows] = value
+    return surfaces
+
+def curve_lookup_table(phis, alphas, x, path=None):
+    """
+    (φ, α) lookup table of curve statistics, cached on disk as .npz
+
+    Parameters:
+    -----------
+    phis, alphas : np.ndarray
+        Ascending 1D grids of φ and α
+    x : np.ndarray
+        Return-period axis the curves are evaluated on
+    path : str, optional
+        .npz file of the cached table; reused when its grids match, rewritten otherwise
+
+    Returns:
+    --------
+    dict
+        'phi', 'alpha', 'x' grids and 'mode', 'mode_refined', 'mean', 'sd' surfaces of shape (nphi, nalpha)
+    """
+    phis, alphas, x = (np.asarray(v, dtype=float) for v in (phis, alphas, x))
+    if path is not None and os.path.exists(path):
+        with np.load(path) as cached:
+            table = {key: cached[key] for key in cached.files}
+        if all(np.array_equal(table[key], grid) for key, grid in (('phi', phis), ('alpha', alphas), ('x', x))):
+            return table
+
+    table = {'phi': phis, 'alpha': alphas, 'x': x}
+    table.update(curve_surfaces(phis, alphas, x))
+    if path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(path, **table)
+    return table
+
+def invert_curve(mode, mean, table):
+    """
+    (φ, α) whose curve has the given mode and mean, by interpolation in a lookup table
+
+    For every φ row the α giving the target mean is interpolated (the mean decreases
+    monotonically with α), the refined mode along that path is interpolated in α, and
+    φ is interpolated at the first crossing of the target mode.
+
+    Parameters:
+    -----------
+    mode, mean : float or np.ndarray
+        Observed mode and mean recurrence (day), broadcast against each other
+    table : dict
+        Output of curve_lookup_table
+
+    Returns:
+    --------
+    phi, alpha : np.ndarray
+        Estimates with the broadcast shape of mode and mean, NaN outside the table
+    """
+    mode, mean = np.broadcast_arrays(np.asarray(mode, dtype=float), np.asarray(mean, dtype=float))
+    shape = mode.shape
+    mode, mean = mode.ravel(), mean.ravel()
+    phis, alphas = table['phi'], table['alpha']
+    mean_surface, mode_surface = table['mean'], table['mode_refined']
+
+    # α on each φ row that matches the target mean, and the mode it implies
+    alpha_path = np.full((len(phis), len(mean)), np.nan)
+    mode_path = np.full((len(phis), len(mean)), np.nan)
+    for i in range(len(phis)):
+        row = mean_surface[i, ::-1]
+        inside = (mean >= row.min()) & (mean <= row.max())
+        alpha_path[i, inside] = np.interp(mean[inside], row, alphas[::-1])
+        mode_path[i, inside] = np.interp(alpha_path[i, inside], alphas, mode_surface[i])
+
+    # First φ interval where the mode path crosses the target mode
+    diff = mode_path - mode
+    crossing = (np.sign(diff[:-1]) != np.sign(diff[1:])) & np.isfinite(diff[:-1]) & np.isfinite(diff[1:])
+    exact = diff == 0
+    found = crossing.any(axis=0)
+    i = np.argmax(crossing, axis=0)
+    q = np.arange(len(mean))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = np.where(exact[i, q], 0, diff[i, q] / (diff[i, q] - diff[i + 1, q]))
+    phi = np.where(found, phis[i] + w * (phis[i + 1] - phis[i]), np.nan)
+    alpha = np.where(found, alpha_path[i, q] + w * (alpha_path[i + 1, q] - alpha_path[i, q]), np.nan)
+    return phi.reshape(shape), alpha.reshape(shape)
@@ -0,0 +1,82 @@
+'''
+Data access code: shared, lazily loaded xarray handles with LRU eviction
+'''
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import xarray as xr
+
+MAX_HANDLES = 32        # open datasets kept at most
+MAX_BYTES = 8 * 2**30   # total size on disk of the files kept open
+
+_handles = OrderedDict()  # (path, mtime, kwargs) -> (dataset, file size)
+_lock = threading.Lock()
+_prefetcher = None
+
+def _key(path, kwargs):
+    path = os.path.abspath(os.path.expanduser(path))
+    return (path, os.path.getmtime(path), tuple(sorted(kwargs.items())))
+
+def _evict(max_handles, max_bytes):
+    '''drop least recently used handles until both limits hold, called with _lock held
+
+    Dropped datasets are not closed, callers may still hold them; xarray closes the file
+    once the last reference goes.
+    '''
+    total = sum(size for _, size in _handles.values())
+    while _handles and (len(_handles) > max_handles or total > max_bytes):
+        _, (_, size) = _handles.popitem(last=False)
+        total -= size
+
+def open_dataset(path, **kwargs):
+    """
+    xr.open_dataset with a shared handle cache keyed by path and modification time
+
+    Datasets stay lazily loaded; the same handle is returned until the file changes on
+    disk or it is evicted as least recently used. Handles leaving the cache are not
+    closed, so datasets a caller still holds keep working.
+
+    Parameters:
+    -----------
+    path : str
+        NetCDF file
+    **kwargs
+        Passed to xr.open_dataset, part of the cache key (values must be hashable)
+
+    Returns:
+    --------
+    xarray.Dataset
+    """
+    key = _key(path, kwargs)
+    with _lock:
+        if key in _handles:
+            _handles.move_to_end(key)
+            return _handles[key][0]
+
+    ds = xr.open_dataset(key[0], **kwargs)
+    with _lock:
+        if key in _handles:  # opened meanwhile by another thread
+            ds.close()
+            _handles.move_to_end(key)
+            return _handles[key][0]
+        stale = [k for k in _handles if k[0] == key[0] and k[2] == key[2]]
+        for k in stale:
+            _handles.pop(k)
+        _handles[key] = (ds, os.path.getsize(key[0]))
+        _evict(MAX_HANDLES, MAX_BYTES)
+    return ds
+
+def prefetch(paths, max_workers=4, **kwargs):
+    '''open the next files a driver loop needs on a background thread pool, returns futures'''
+    global _prefetcher
+    with _lock:
+        if _prefetcher is None:
+            _prefetcher = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+    return [_prefetcher.submit(open_dataset, path, **kwargs) for path in paths if os.path.exists(path)]
+
+def close_all():
+    '''close every cached handle, for the end of a run; datasets callers still hold stop working'''
+    with _lock:
+        while _handles:
+            _handles.popitem(last=False)[1][0].close()
@@ -11,69 +11,57 @@ import os
 import seaborn as sns
 import matplotlib.patches as mpatches
 import BlockingDetectionFunctions 
+import CurveFunctions
+import DataAccessFunctions
+import HistogramFunctions
+import RenderFunctions
+import InstrumentFunctions
 
-def interval(arr):
-    '''return intervals between True given a boolean array'''
-    intervals = []
-    true_indices = np.where(arr)[0]
-
-    if len(true_indices) >= 2:
-        gaps = np.diff(true_indices) - 1
-        intervals.extend(gaps)
-    return intervals
+def interval(arr, segments=None):
+    '''return intervals between True given a boolean array, only within each (start, stop) segment if given'''
+    if segments is None:
+        return BlockingDetectionFunctions.onset_gaps(arr)
+    return BlockingDetectionFunctions.segmented_gaps(arr, segments)[0]
 
 
+@InstrumentFunctions.instrumented
 def load_phi(region, season, filepath):
-    ds = xr.open_dataset(filepath)
-    Lon1, Lon2, _, _ = BlockingDetectionFunctions.Region_ERA(f"{region} {season}", lat_filter=True)
-    LON = ((Lon1+(Lon2-Lon1)%360/2)%360)
+    ds = DataAccessFunctions.open_dataset(filepath)
+    LON = BlockingDetectionFunctions.region_center_lon(f"{region} {season}")
     phi = ds['temp_corr'].sel(lon = LON)  
     return phi.values
 
+@InstrumentFunctions.instrumented
 def load_data(nc_path):
-    intervals = []
-    ds = xr.open_dataset(nc_path)
+    '''onset probability and KDE recurrence of a catalog; its return_period counts come from HistogramFunctions'''
+    ds = DataAccessFunctions.open_dataset(nc_path)
     recurrence = ds.recurrence.values
-    start_dates = ds['start_date'].values  # shape: (event,)
-    start_dates.sort()
-    time_values = ds['time'].values        # shape: (time,)
-
-    time_to_index = {t: i for i, t in enumerate(time_values)}
-
-    time_bool = np.zeros(len(time_values), dtype=bool)
-
-    # Loop over start_dates and mark True where it matches a time index
-    for sd in start_dates:
-        if sd in time_to_index:
-            time_bool[time_to_index[sd]] = True
-    
-    array = time_bool
-    intervals = interval(array)
+    nevent, ndays = ds.sizes['event'], ds.sizes['time']
     method = str(ds.data)
-    Pk = len(start_dates)/len(time_values)
-    print(f"{method}: {int(len(start_dates))} events, {int(len(time_values))} days, Pk: {Pk}")
-    return np.array(intervals), Pk, recurrence
+    Pk = nevent/ndays
+    InstrumentFunctions.log(f"{method}: {int(nevent)} events, {int(ndays)} days, Pk: {Pk}")
+    return Pk, recurrence
 
 def y_curve(phi, Pk, x):
-    P = (1-phi**(x))*Pk
-    y = P * ((1 - P) ** (x - 1))
-
-    y /= y.sum()
-    max_x = np.where(y==np.max(y))[0][0]
+    y = CurveFunctions.recurrence_curve(phi, Pk, x)
+    max_x = int(CurveFunctions.curve_moments(y, x)['mode'])
     return y, max_x
 
-def plot(return_period1, return_period2, Pk1, Pk2, phi, region_name, N=90):
-    return_period1 = return_period1[return_period1<=N] # red noise
-    return_period2 = return_period2[return_period2<=N] # ERA
+@InstrumentFunctions.instrumented
+def plot(count1, count2, Pk1, Pk2, phi, region_name, N=90):
+    '''count1, count2: red noise and ERA5 return-period counts for 0..N days, as from HistogramFunctions'''
+    count1 = count1[:N+1] # red noise
+    count2 = count2[:N+1] # ERA
     x1 = np.arange(N)
     y1, max_x = y_curve(phi, Pk1, x1)
     x2 = np.arange(N)
     y2, max_x = y_curve(phi, Pk2, x2)
+    # bins as lists, seaborn compares bins to 'auto' when weights are given
     c1, C1, c2, C2 = "grey", "grey", "skyblue", "k"
 
     fig = plt.figure(figsize=(7,5))
-    sns.histplot(return_period1, bins=x1, label=f'Red noise model', stat='density', kde=False, color=c1, alpha=0.2, edgecolor=None)
-    sns.histplot(return_period2, bins=x2, label=f'ERA5 data', stat='density', kde=False, color=c2, alpha=0.7, edgecolor='skyblue')
+    sns.histplot(x=np.arange(len(count1)), weights=count1, bins=x1.tolist(), label=f'Red noise model', stat='density', kde=False, color=c1, alpha=0.2, edgecolor=None)
+    sns.histplot(x=np.arange(len(count2)), weights=count2, bins=x2.tolist(), label=f'ERA5 data', stat='density', kde=False, color=c2, alpha=0.7, edgecolor='skyblue')
     h3, = plt.plot(x2, y2, color=C2, linewidth=2, alpha=0.5,
                 label=f"Predicted recurrence constrained by ERA5\n"+
                 fr"φ, α = {phi:.2g}, {Pk2:.2g}"
@@ -108,14 +96,31 @@ ERA_path = f"{basepath}/data/ERA5/BlockingEvents/ReturnPeriods"
 savingpath = f"{basepath}/plots/ERA_Hist"
 os.makedirs(savingpath, exist_ok=True)
 
-for region, H, name in zip(region_list, H_list, name_list):
-    for season in season_list:
-        ## load red noise model or ERA5
-        return_period_ERA, Pk_ERA, recurrence_ERA = load_data(f"{ERA_path}/{region}_{season}.nc")
-        return_period_red, Pk_red, recurrence_red = load_data(f"{red_path}/{region}_{season}.nc")
-        phi = load_phi(region, season, f"{phi_path}/LWA_{H}_{season}.nc")
-
-        # Plot the distribution
-        title = f"{name} blocks, {season}"
-        fig = plot(return_period_red,return_period_ERA, Pk_red, Pk_ERA, phi, title, N = 90)
-        plt.savefig(f"{savingpath}/{region}_{season}.png", dpi = 600)
+@InstrumentFunctions.instrumented
+def render(region, H, name, season):
+    ## load red noise model or ERA5
+    Pk_ERA, recurrence_ERA = load_data(f"{ERA_path}/{region}_{season}.nc")
+    Pk_red, recurrence_red = load_data(f"{red_path}/{region}_{season}.nc")
+    phi = load_phi(region, season, f"{phi_path}/LWA_{H}_{season}.nc")
+
+    # Precomputed counts of the catalogs' return_period, as PipelineFunctions.render_ERA
+    cube = HistogramFunctions.load_cube()
+    _, count_ERA, _ = HistogramFunctions.histogram(cube, "ERA5", region, season, max_days=90)
+    _, count_red, _ = HistogramFunctions.histogram(cube, "Red_noise", region, season, max_days=90)
+
+    # Plot the distribution
+    title = f"{name} blocks, {season}"
+    fig = plot(count_red, count_ERA, Pk_red, Pk_ERA, phi, title, N = 90)
+    plt.savefig(f"{savingpath}/{region}_{season}.png", dpi = 600)
+    return fig
+
+def figure_jobs():
+    return [RenderFunctions.with_files(RenderFunctions.job(f"ERA_red_curve {region} {season}", "ERA_red_curve", "render",
+                                                           region, H, name, season),
+                                       [f"{ERA_path}/{region}_{season}.nc", f"{red_path}/{region}_{season}.nc",
+                                        f"{phi_path}/LWA_{H}_{season}.nc"])
+            for region, H, name in zip(region_list, H_list, name_list) for season in season_list]
+
+if __name__ == "__main__":
+    HistogramFunctions.load_cube()  # build or refresh the cube once, before the jobs load it
+    RenderFunctions.run_jobs(figure_jobs())
@@ -0,0 +1,124 @@
+'''
+Ensemble code: per-member recurrence statistics of CESM LENS catalogs on a local worker pool
+'''
+import os
+import glob
+import functools
+import numpy as np
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+import BlockingDetectionFunctions
+import DataAccessFunctions
+import FitFunctions
+import InstrumentFunctions
+
+basepath = os.path.expanduser("~/Github")
+member_folder = f"{basepath}/data/CESM1/BlockingEvents/ReturnPeriods/RCP/members"
+
+def member_paths(region, season, folder=member_folder):
+    '''per-member catalogs {region}_{season}_{member}.nc, sorted by member number'''
+    return sorted(glob.glob(f"{folder}/{region}_{season}_*.nc"),
+                  key=lambda path: int(os.path.splitext(path)[0].rsplit('_', 1)[1]))
+
+def member_intervals(path, season):
+    """
+    Load one member catalog and compute its within-season return periods
+
+    Returns:
+    --------
+    dict
+        'gaps' within-season return periods, 'nevent', 'ndays' and 'nseason' of the member
+    """
+    ds = DataAccessFunctions.open_dataset(path)
+    times = ds['time'].values
+    onset_mask, _, _ = BlockingDetectionFunctions.map_events_to_timeline(times, ds['start_date'].values)
+    segments = BlockingDetectionFunctions.season_segments(times, season)
+    gaps, _ = BlockingDetectionFunctions.segmented_gaps(onset_mask, segments)
+    return {'gaps': gaps, 'nevent': int(ds.sizes['event']), 'ndays': len(times), 'nseason': len(segments[0])}
+
+def map_members(func, items, backend="process", max_workers=None):
+    """
+    func over items on a local process pool, a local dask cluster or serially
+
+    Parameters:
+    -----------
+    backend : str, default="process"
+        "process" (concurrent.futures), "dask" (dask.distributed LocalCluster, optional
+        dependency) or "serial"
+    """
+    if backend == "serial":
+        return [func(item) for item in items]
+    if backend == "process":
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(func, items))
+    if backend == "dask":
+        try:
+            from dask.distributed import LocalCluster, Client
+        except ImportError as e:
+            raise ImportError("backend='dask' needs dask.distributed, or use backend='process'") from e
+        with LocalCluster(n_workers=max_workers, processes=True) as cluster, Client(cluster) as client:
+            return client.gather(client.map(func, items))
+    raise ValueError("Invalid backend. Choose 'process', 'dask' or 'serial'.")
+
+@InstrumentFunctions.instrumented
+def ensemble_statistics(paths, season, members=None, backend="process", max_workers=None):
+    """
+    Per-member onset probability, return-period mode and mean, and fitted φ and α
+
+    Members are loaded and their within-season intervals computed concurrently; KDE
+    modes and the maximum-likelihood fit then run vectorized over the member dimension.
+
+    Parameters:
+    -----------
+    paths : list of str
+        One catalog per member, e.g. from member_paths
+    season : str
+        "DJF" or "JJA"
+    members : array-like, optional
+        Member labels, defaults to 0..n-1
+
+    Returns:
+    --------
+    xarray.Dataset
+        Variables on dim member: nevent, nseason, Pk, mode, mean, phi, alpha, nll,
+        and counts (member, return_period)
+    """
+    results = map_members(functools.partial(member_intervals, season=season), paths, backend, max_workers)
+    gaps = [r['gaps'] for r in results]
+    season_days = BlockingDetectionFunctions.season_length(season)
+
+    counts, support = FitFunctions.return_period_counts(gaps, season_days)
+    phi, alpha, nll = FitFunctions.fit_curves(counts, support)
+    mode = BlockingDetectionFunctions.kde_modes(gaps)
+    mean = np.array([g.mean() if len(g) else np.nan for g in gaps])
+
+    return xr.Dataset(
+        {
+            'nevent': ('member', [r['nevent'] for r in results]),
+            'nseason': ('member', [r['nseason'] for r in results]),
+            'Pk': ('member', [r['nevent'] / r['ndays'] for r in results]),
+            'mode': ('member', mode),
+            'mean': ('member', mean),
+            'phi': ('member', phi),
+            'alpha': ('member', alpha),
+            'nll': ('member', nll),
+            'counts': (('member', 'return_period'), counts),
+        },
+        coords={'member': np.arange(len(paths)) if members is None else np.asarray(members),
+                'return_period': np.arange(counts.shape[1])},
+        attrs={'season': season},
+    )
+
+def ensemble_summary(ds, dim="member"):
+    '''ensemble mean, spread (standard deviation), minimum and maximum along a new dim stat'''
+    return xr.concat([ds.mean(dim), ds.std(dim, ddof=1), ds.min(dim), ds.max(dim)],
+                     dim=xr.DataArray(["mean", "spread", "min", "max"], dims="stat"))
+
+if __name__ == "__main__":
+    for region in ["Atlantic", "Pacific", "BAM"]:
+        for season in ["DJF", "JJA"]:
+            paths = member_paths(region, season)
+            if not paths:
+                continue
+            summary = ensemble_summary(ensemble_statistics(paths, season)[['Pk', 'mode', 'mean', 'phi', 'alpha']])
+            InstrumentFunctions.log(f"{region} {season}, {len(paths)} members\n{summary.to_dataframe().round(3)}")
@@ -0,0 +1,287 @@
+'''
+Blocking event detection code: streaming LWA thresholding and event tracking
+'''
+import numpy as np
+import xarray as xr
+from scipy import ndimage
+from concurrent.futures import ProcessPoolExecutor
+import BlockingDetectionFunctions
+import InstrumentFunctions
+
+def season_time_index(ds, season, time_name="time"):
+    '''indices of the time axis inside a season, all years in time order'''
+    ranges = BlockingDetectionFunctions.season_ranges(ds[time_name].values, season).values()
+    index = [np.arange(r.start, r.stop) if isinstance(r, slice) else r for r in ranges]
+    return np.concatenate(index) if index else np.array([], dtype=int)
+
+def contiguous_chunks(time_index, days, chunk_days):
+    """
+    Split selected time indices into chunks that never span a gap in days
+
+    Returns:
+    --------
+    list of (slice, bool)
+        Slice into time_index and whether it continues the previous chunk without a gap
+    """
+    if len(time_index) == 0:
+        return []
+    breaks = np.flatnonzero((np.diff(time_index) != 1) | (np.diff(days[time_index]) != 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(time_index)]])
+    chunks = []
+    for start, end in zip(starts, ends):
+        for chunk_start in range(start, end, chunk_days):
+            chunks.append((slice(chunk_start, min(chunk_start + chunk_days, end)), chunk_start != start))
+    return chunks
+
+def lat_band_index(lat, Lat1, Lat2):
+    '''indices of latitudes inside a band, for ascending or descending latitude axes'''
+    lat = np.asarray(lat)
+    return np.flatnonzero((lat >= min(Lat1, Lat2)) & (lat <= max(Lat1, Lat2)))
+
+def band_reduce(field, lat):
+    '''latitude mean and latitude of the maximum of a (time, lat, lon) band'''
+    return field.mean(axis=1), np.asarray(lat)[np.argmax(field, axis=1)]
+
+@InstrumentFunctions.instrumented
+def percentile_threshold(path, season, Lat1, Lat2, percentile=90, var_name="LWA",
+                         time_name="time", lat_name="lat", lon_name="lon", lon_chunk=30):
+    '''percentile climatology per longitude of band-mean LWA over the season, read in longitude slabs;
+    (nq, nlon) for a vector of percentiles, from the same slabs'''
+    with xr.open_dataset(path) as ds:
+        time_index = season_time_index(ds, season, time_name)
+        lat_index = lat_band_index(ds[lat_name].values, Lat1, Lat2)
+        nlon = ds.sizes[lon_name]
+        threshold = np.empty(np.shape(percentile) + (nlon,))
+        for start in range(0, nlon, lon_chunk):
+            lons = slice(start, min(start + lon_chunk, nlon))
+            field = ds[var_name].isel({time_name: time_index, lat_name: lat_index, lon_name: lons})
+            field = field.transpose(time_name, lat_name, lon_name).values
+            threshold[..., lons] = np.percentile(field.mean(axis=1), percentile, axis=0)
+    return threshold
+
+def _find_roots(parent):
+    '''resolve union-find parents to roots by pointer jumping'''
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+def initial_state(nlon):
+    '''tracking state before the first chunk, no events open'''
+    empty = {key: np.array([], dtype=dtype) for key, dtype in
+             (('start', int), ('end', int), ('lon_index', int), ('lat', float), ('value', float))}
+    return {'offset': 0, 'prev_row': np.zeros(nlon, dtype=int), 'open': empty}
+
+def track_chunk(exceed, band_mean, lat_of_max, state, continues):
+    """
+    Label blocked regions in one (time, lon) chunk and merge them with events left open by the previous chunk
+
+    Regions are 4-connected in time and longitude, with longitude periodic across the dateline.
+
+    Parameters:
+    -----------
+    exceed, band_mean, lat_of_max : np.ndarray
+        (ndays, nlon) blocked mask, band-mean LWA and latitude of the band maximum
+    state : dict
+        Carried state: 'offset' time position of the chunk start, 'prev_row' (nlon,) 1-based
+        positions of open events on the last day of the previous chunk, and 'open' event arrays
+        ('start', 'end', 'lon_index', 'lat', 'value')
+    continues : bool
+        False when the chunk starts after a gap in time (e.g. a new season), closing all open events
+
+    Returns:
+    --------
+    closed : dict
+        Arrays 'start', 'end', 'lon_index', 'lat' of events that ended in this chunk or before it
+    state : dict
+        Updated carried state
+    """
+    ndays, nlon = exceed.shape
+    offset = state['offset']
+    opened = state['open'] if continues else {key: np.array([], dtype=value.dtype) for key, value in state['open'].items()}
+    ended = {key: state['open'][key][:0 if continues else None] for key in ('start', 'end', 'lon_index', 'lat')}
+    prev_row = state['prev_row'] if continues else np.zeros(nlon, dtype=int)
+    k = len(opened['start'])
+
+    labels, n = ndimage.label(exceed, structure=[[0, 1, 0], [1, 1, 1], [0, 1, 0]])
+    t, j = np.nonzero(labels)
+    lab = labels[t, j] - 1
+
+    # Per-component onset: earliest day, strongest longitude on that day
+    order = np.lexsort((-band_mean[t, j], t, lab))
+    first = order[np.flatnonzero(np.diff(np.concatenate([[-1], lab[order]])))]
+    end = np.full(n, -1)
+    np.maximum.at(end, lab, t)
+
+    nodes = {
+        'start': np.concatenate([opened['start'], t[first] + offset]),
+        'end': np.concatenate([opened['end'], end + offset]),
+        'lon_index': np.concatenate([opened['lon_index'], j[first]]),
+        'lat': np.concatenate([opened['lat'], lat_of_max[t[first], j[first]]]),
+        'value': np.concatenate([opened['value'], band_mean[t[first], j[first]]]),
+    }
+
+    # Links across the previous chunk boundary and across the dateline
+    carry = (prev_row > 0) & (labels[0] > 0)
+    wrap = (labels[:, 0] > 0) & (labels[:, -1] > 0)
+    pairs = np.concatenate([
+        np.column_stack([prev_row[carry] - 1, k + labels[0][carry] - 1]),
+        np.column_stack([k + labels[:, 0][wrap] - 1, k + labels[:, -1][wrap] - 1]),
+    ]).astype(int)
+    parent = np.arange(k + n)
+    for a, b in np.unique(pairs, axis=0):
+        ra, rb = _find_roots(parent)[[a, b]]
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    root = _find_roots(parent)
+
+    # Combine nodes per root: earliest onset, latest end
+    order = np.lexsort((-nodes['value'], nodes['start'], root))
+    heads = order[np.flatnonzero(np.diff(np.concatenate([[-1], root[order]])))]
+    group_end = np.full(k + n, -1)
+    np.maximum.at(group_end, root, nodes['end'])
+    events = {key: value[heads] for key, value in nodes.items()}
+    events['end'] = group_end[root[heads]]
+
+    # Events touching the last day stay open for the next chunk
+    last_row = labels[-1]
+    open_roots = np.unique(root[k + last_row[last_row > 0] - 1])
+    still_open = np.isin(root[heads], open_roots)
+    position = np.zeros(k + n, dtype=int)
+    position[root[heads][still_open]] = np.arange(1, still_open.sum() + 1)
+    prev_row = np.zeros(nlon, dtype=int)
+    prev_row[last_row > 0] = position[root[k + last_row[last_row > 0] - 1]]
+
+    state = {
+        'offset': offset + ndays,
+        'prev_row': prev_row,
+        'open': {key: value[still_open] for key, value in events.items()},
+    }
+    closed = {key: np.concatenate([ended[key], events[key][~still_open]]) for key in ended}
+    return closed, state
+
+@InstrumentFunctions.instrumented
+def detect_events(path, region, season, percentile=90, min_duration=5, threshold=None, box=None,
+                  chunk_days=900, var_name="LWA", time_name="time", lat_name="lat", lon_name="lon"):
+    """
+    Detect blocking events of one region and season from an LWA NetCDF file, streamed in time chunks
+
+    Band-mean LWA over the region's latitudes is thresholded against a per-longitude
+    percentile climatology. Blocked regions are tracked across longitude (with dateline
+    wrap) and time; an event is kept if it persists for min_duration days and its onset
+    longitude, where band-mean LWA peaks on the first day, lies in the region box.
+
+    Parameters:
+    -----------
+    path : str
+        LWA NetCDF file with (time, lat, lon) variable var_name
+    region, season : str
+        e.g. "Atlantic", "DJF"
+    percentile : float, default=90
+        Climatological percentile used as threshold when threshold is not given
+    min_duration : int, default=5
+        Minimum persistence (day)
+    threshold : np.ndarray, optional
+        (nlon,) precomputed threshold, e.g. from percentile_threshold over a longer record
+    box : array-like, optional
+        [Lon1, Lon2, Lat1, Lat2], defaults to Region_ERA
+    chunk_days : int, default=900
+        Days read per chunk, memory is chunk_days x nlat_band x nlon
+
+    Returns:
+    --------
+    xarray.Dataset
+        start_date, event_lon, event_lat, duration (event), return_period and recurrence,
+        with the season time axis, as in the BlockingEvents/ReturnPeriods files
+    """
+    box = BlockingDetectionFunctions.Region_ERA(f"{region} {season}") if box is None else np.asarray(box)
+    Lat1, Lat2 = box[2], box[3]
+    if threshold is None:
+        threshold = percentile_threshold(path, season, Lat1, Lat2, percentile, var_name,
+                                         time_name, lat_name, lon_name)
+
+    with xr.open_dataset(path) as ds:
+        time_index = season_time_index(ds, season, time_name)
+        times = ds[time_name].values
+        days = BlockingDetectionFunctions.day_numbers(times)
+        lat_index = lat_band_index(ds[lat_name].values, Lat1, Lat2)
+        lat, lon = ds[lat_name].values[lat_index], ds[lon_name].values
+        nlon = len(lon)
+
+        state = initial_state(nlon)
+        found = []
+        for rows, continues in contiguous_chunks(time_index, days, chunk_days):
+            field = ds[var_name].isel({time_name: time_index[rows], lat_name: lat_index})
+            field = field.transpose(time_name, lat_name, lon_name).values
+            band_mean, lat_of_max = band_reduce(field, lat)
+            closed, state = track_chunk(band_mean > threshold, band_mean, lat_of_max, state, continues)
+            found.append(closed)
+        found.append({key: state['open'][key] for key in ('start', 'end', 'lon_index', 'lat')})
+
+    attrs = {'data': str(path), 'region': region, 'season': season,
+             'percentile': percentile, 'min_duration': min_duration}
+    return events_catalog(found, times[time_index], lon, box, min_duration, attrs)
+
+def events_catalog(found, season_times, lon, box, min_duration=5, attrs=None):
+    """
+    Catalog of tracked events: duration and region filter, onset order and return periods
+
+    Parameters:
+    -----------
+    found : list of dict
+        'start', 'end', 'lon_index', 'lat' arrays from track_chunk, positions on season_times
+    season_times : np.ndarray
+        Season time axis the positions refer to
+    lon : np.ndarray
+        Longitudes of the tracked grid
+
+    Returns:
+    --------
+    xarray.Dataset
+        In the BlockingEvents/ReturnPeriods layout, as detect_events
+    """
+    events = {key: np.concatenate([f[key] for f in found]) for key in found[0]}
+    duration = events['end'] - events['start'] + 1
+    event_lon = lon[events['lon_index']]
+    keep = (duration >= min_duration) & BlockingDetectionFunctions.in_region(event_lon, events['lat'], box)
+    order = np.argsort(events['start'][keep], kind='stable')
+
+    start_date = season_times[events['start'][keep][order]]
+    _, _, return_period = BlockingDetectionFunctions.map_events_to_timeline(season_times, start_date)
+    recurrence = BlockingDetectionFunctions.kde(return_period)
+
+    return xr.Dataset(
+        {
+            'start_date': ('event', start_date),
+            'event_lon': ('event', event_lon[keep][order]),
+            'event_lat': ('event', events['lat'][keep][order]),
+            'duration': ('event', duration[keep][order]),
+            'return_period': ('interval', return_period),
+            'recurrence': np.nan if recurrence is None else recurrence,
+        },
+        coords={'time': season_times},
+        attrs=attrs or {},
+    )
+
+def _detect_job(job):
+    '''worker wrapper for detect_catalogs'''
+    return detect_events(**job)
+
+def detect_catalogs(jobs, max_workers=None):
+    """
+    Run detect_events for many regions and ensemble members on a process pool
+
+    Parameters:
+    -----------
+    jobs : list of dict
+        Keyword arguments of detect_events, one per region/season/member file
+
+    Returns:
+    --------
+    list of xarray.Dataset
+        Catalogs in the order of jobs
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_detect_job, jobs))
@@ -0,0 +1,195 @@
+'''
+Event store code: one columnar, memory-mapped table of blocking events from every catalog
+'''
+import os
+import json
+import shutil
+import numpy as np
+import xarray as xr
+import BlockingDetectionFunctions
+import InstrumentFunctions
+
+basepath = os.path.expanduser("~/Github")
+store_path = f"{basepath}/data/EventStore/events"  # its own directory, the swap replaces all of it
+
+# Column name -> dtype on disk; dataset, region and season are stored as category codes
+COLUMNS = {
+    'dataset': np.int8, 'region': np.int8, 'season': np.int8, 'member': np.int16, 'year': np.int16,
+    'start_date': 'datetime64[D]', 'lon': np.float32, 'lat': np.float32,
+    'duration': np.int16, 'return_period': np.int32,
+}
+CATEGORIES = ('dataset', 'region', 'season')
+PARTITION = ('dataset', 'region', 'season', 'member')
+
+def event_return_periods(time_values, start_dates):
+    '''days from each event onset to the next distinct onset along the time axis, -1 for the last one'''
+    onset_mask, nearest_index, _ = BlockingDetectionFunctions.map_events_to_timeline(time_values, start_dates)
+    onsets = np.flatnonzero(onset_mask)
+    following = np.searchsorted(onsets, nearest_index, side='right')
+    has_next = (following < len(onsets)) & onset_mask[nearest_index]
+    return np.where(has_next, onsets[np.minimum(following, len(onsets) - 1)] - nearest_index - 1, -1)
+
+def read_catalog(path, dataset, region, season, member=0):
+    """
+    Columns of one blocking event NetCDF file (ReturnPeriods or per-year BlockingEvents layout)
+
+    Returns:
+    --------
+    dict
+        Column arrays of the file's events, dataset/region/season as strings
+    """
+    with xr.open_dataset(path) as ds:
+        start = ds['start_date'].values
+        nevent = len(start)
+        lon = ds['event_lon'].values if 'event_lon' in ds else np.full(nevent, np.nan)
+        lat = ds['event_lat'].values if 'event_lat' in ds else np.full(nevent, np.nan)
+        duration = ds['duration'].values if 'duration' in ds else np.full(nevent, -1)
+        if 'time' in ds.coords and nevent:
+            return_period = event_return_periods(ds['time'].values, start)
+        else:
+            return_period = np.full(nevent, -1)
+
+    fields = BlockingDetectionFunctions.calendar_fields(start)
+    year = fields['year'] - ((season == "DJF") & (fields['month'] < 12))  # DJF belongs to the December year
+    return {
+        'dataset': np.full(nevent, dataset), 'region': np.full(nevent, region), 'season': np.full(nevent, season),
+        'member': np.full(nevent, member), 'year': year,
+        'start_date': BlockingDetectionFunctions.to_datetime64(start, 'D') if nevent else np.array([], 'datetime64[D]'),
+        'lon': lon, 'lat': lat, 'duration': duration, 'return_period': return_period,
+    }
+
+def catalog_files(basepath=basepath):
+    '''(path, dataset, region, season, member) of every event file in the data tree'''
+    folders = {
+        "ERA5": f"{basepath}/data/ERA5/BlockingEvents/ReturnPeriods",
+        "Red_noise": f"{basepath}/data/Red_noise/BlockingEvents/ReturnPeriods",
+        "CESM1-Hist": f"{basepath}/data/CESM1/BlockingEvents/ReturnPeriods/Hist",
+        "CESM1-RCP": f"{basepath}/data/CESM1/BlockingEvents/ReturnPeriods/RCP",
+    }
+    files = []
+    for dataset, folder in folders.items():
+        for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+            if name.endswith(".nc"):
+                region, season = os.path.splitext(name)[0].split('_')
+                files.append((f"{folder}/{name}", dataset, region, season, 0))
+
+    # Per-year files of all events before the region filter, BlockingEvents_{region}_{season}_{YEAR}.nc
+    folder = f"{basepath}/data/ERA5/BlockingEvents"
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if name.startswith("BlockingEvents_") and name.endswith(".nc"):
+            _, region, season, _ = os.path.splitext(name)[0].split('_')
+            files.append((f"{folder}/{name}", "ERA5-yearly", region, season, 0))
+    return files
+
+def write_store(tables, path=store_path):
+    """
+    Write event tables as one store: a .npy file per column and an index in meta.json
+
+    Rows are sorted by dataset, region, season, member and start date, so every
+    partition is a contiguous row range and dates are ascending within it.
+
+    Parameters:
+    -----------
+    tables : list of dict
+        Column arrays, e.g. from read_catalog
+    """
+    columns = {name: np.concatenate([np.asarray(t[name]) for t in tables]) if tables else np.array([])
+               for name in COLUMNS}
+    categories = {name: sorted(set(columns[name].tolist())) for name in CATEGORIES}
+    for name in CATEGORIES:
+        columns[name] = np.searchsorted(categories[name], columns[name])
+    columns = {name: columns[name].astype(dtype) for name, dtype in COLUMNS.items()}
+
+    order = np.lexsort(tuple(columns[name] for name in ('start_date',) + PARTITION[::-1]))
+    columns = {name: column[order] for name, column in columns.items()}
+
+    keys = np.column_stack([columns[name].astype(int) for name in PARTITION])
+    starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1 if len(keys) else np.array([], int)
+    bounds = np.concatenate([[0], starts, [len(keys)]]) if len(keys) else np.array([0])
+    partitions = [[categories[name][keys[b, i]] for i, name in enumerate(CATEGORIES)] + [int(keys[b, 3]), int(b), int(e)]
+                  for b, e in zip(bounds[:-1], bounds[1:])]
+
+    # Write next to the old store and swap it in: readers never see a partial store, and
+    # the path is missing only between the two renames
+    tmp, old = f"{path}.tmp", f"{path}.old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, column in columns.items():
+        np.save(f"{tmp}/{name}.npy", column)
+    with open(f"{tmp}/meta.json", "w") as f:
+        json.dump({'nrows': len(order), 'categories': categories, 'partitions': partitions}, f)
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)  # open memory maps of the old columns stay valid
+
+@InstrumentFunctions.instrumented
+def import_catalogs(files=None, path=store_path):
+    '''build the store from the existing NetCDF event files, defaults to catalog_files()'''
+    files = catalog_files() if files is None else files
+    write_store([read_catalog(*f) for f in files], path)
+    return open_store(path)
+
+def open_store(path=store_path):
+    '''memory-mapped columns and index of a store'''
+    with open(f"{path}/meta.json") as f:
+        meta = json.load(f)
+    meta['columns'] = {name: np.load(f"{path}/{name}.npy", mmap_mode='r') for name in COLUMNS}
+    meta['path'] = path
+    return meta
+
+def _matches(value, wanted):
+    return wanted is None or value in (wanted if isinstance(wanted, (list, tuple, set)) else [wanted])
+
+@InstrumentFunctions.instrumented
+def select(store, dataset=None, region=None, season=None, member=None, years=None, where=None, columns=None):
+    """
+    Events matching the filters, read with one vectorized scan over the selected partitions
+
+    Parameters:
+    -----------
+    store : dict
+        From open_store
+    dataset, region, season, member : value or list, optional
+        Partition filters, resolved from the index without reading any column
+    years : (int, int), optional
+        Inclusive season-year range, resolved by binary search within each partition
+    where : dict, optional
+        Column -> (low, high) inclusive bounds, None for an open side,
+        e.g. {'duration': (6, None)} for duration > 5
+    columns : list of str, optional
+        Columns to return, defaults to all
+
+    Returns:
+    --------
+    dict
+        Column arrays, dataset/region/season decoded to strings
+    """
+    data = store['columns']
+    ranges = [(start, stop) for d, r, s, m, start, stop in store['partitions']
+              if _matches(d, dataset) and _matches(r, region) and _matches(s, season) and _matches(m, member)]
+    if years is not None:
+        # Dates, and so season years, are sorted within a partition
+        ranges = [(start + np.searchsorted(data['year'][start:stop], years[0], 'left'),
+                   start + np.searchsorted(data['year'][start:stop], years[1], 'right')) for start, stop in ranges]
+    rows = np.concatenate([np.arange(start, stop) for start, stop in ranges]) if ranges else np.array([], dtype=int)
+
+    for name, (low, high) in (where or {}).items():
+        values = data[name][rows]
+        keep = np.ones(len(rows), dtype=bool)
+        if low is not None:
+            keep &= values >= low
+        if high is not None:
+            keep &= values <= high
+        rows = rows[keep]
+
+    result = {}
+    for name in columns or COLUMNS:
+        values = data[name][rows]
+        result[name] = np.asarray(store['categories'][name])[values] if name in CATEGORIES else np.asarray(values)
+    return result
+
+if __name__ == "__main__":
+    store = import_catalogs()
+    InstrumentFunctions.log(f"{store['nrows']} events in {len(store['partitions'])} partitions written to {store['path']}")
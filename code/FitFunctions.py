@@ -0,0 +1,157 @@
+'''
+Maximum-likelihood fitting of φ and α from return-period catalogs
+'''
+import os
+import numpy as np
+import xarray as xr
+from scipy.optimize import minimize
+import BlockingDetectionFunctions
+import CurveFunctions
+import InstrumentFunctions
+
+def return_period_counts(return_periods, season_days):
+    """
+    Integer-day histograms of return periods on the curve support, one row per catalog
+
+    Parameters:
+    -----------
+    return_periods : list of array-like
+        return_period values of each catalog
+    season_days : int or array-like
+        Length of the curve domain x = 0..season_days-1 for each catalog
+
+    Returns:
+    --------
+    counts : np.ndarray
+        (ncat, max(season_days)) event counts per return period
+    support : np.ndarray
+        (ncat, max(season_days)) bool, 1 <= x < season_days of each catalog
+    """
+    season_days = np.broadcast_to(np.asarray(season_days, dtype=int), (len(return_periods),))
+    nx = int(season_days.max())
+    x = np.arange(nx)
+    support = (x >= 1) & (x < season_days[:, None])
+
+    counts = np.zeros((len(return_periods), nx))
+    for c, Return in enumerate(return_periods):
+        Return = np.asarray(Return)
+        Return = Return[np.isfinite(Return)].astype(int)
+        Return = Return[(Return >= 1) & (Return < season_days[c])]
+        counts[c] = np.bincount(Return, minlength=nx)
+    return counts, support
+
+def neg_log_likelihood(phi, alpha, counts, support):
+    """
+    Negative log-likelihood of each catalog under the normalized curve, with analytic gradient
+
+    Returns:
+    --------
+    nll, dnll_dphi, dnll_dalpha : np.ndarray
+        Arrays of shape (ncat,)
+    """
+    phi, alpha = phi[:, None], alpha[:, None]
+    x = np.arange(counts.shape[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        P = (1 - phi**x) * alpha
+        logf = np.where(support, np.log(P) + (x - 1) * np.log1p(-P), -np.inf)
+        dlogf_dP = np.where(support, 1/P - (x - 1)/(1 - P), 0)
+        dP_dphi = np.where(support, -x * phi**(x - 1) * alpha, 0)
+    dP_dalpha = 1 - phi**x
+
+    logf_max = logf.max(axis=1, keepdims=True)
+    f = np.exp(logf - logf_max)
+    logZ = np.log(f.sum(axis=1)) + logf_max[:, 0]
+    y = f / f.sum(axis=1, keepdims=True)
+
+    n = counts.sum(axis=1)
+    logf = np.where(support, logf, 0)
+    nll = -(np.sum(counts * logf, axis=1) - n * logZ)
+    grads = []
+    for dP in (dP_dphi, dP_dalpha):
+        g = dlogf_dP * dP
+        grads.append(-(np.sum(counts * g, axis=1) - n * np.sum(y * g, axis=1)))
+    return nll, grads[0], grads[1]
+
+def initial_guess(counts, support, table=None):
+    '''warm start from the lookup-table inversion of observed mode and mean, geometric guess elsewhere'''
+    x = np.arange(counts.shape[1])
+    n = np.maximum(counts.sum(axis=1), 1)
+    mean = np.sum(counts * x, axis=1) / n
+    samples = [np.repeat(x, c.astype(int)) for c in counts]
+    mode = BlockingDetectionFunctions.kde_modes(samples)
+
+    phi0 = np.full(len(counts), 0.7)
+    alpha0 = np.clip(1 / np.maximum(mean, 1), 1e-3, 0.5)
+    if table is None:
+        table = CurveFunctions.curve_lookup_table(np.linspace(0.05, 0.97, 93), np.linspace(0.005, 0.2, 79), x)
+    phi_lut, alpha_lut = CurveFunctions.invert_curve(mode, mean, table)
+    found = np.isfinite(phi_lut) & np.isfinite(alpha_lut)
+    phi0[found], alpha0[found] = phi_lut[found], alpha_lut[found]
+    return phi0, alpha0
+
+def fit_curves(counts, support, x0=None, table=None, tol=1e-10):
+    """
+    Joint maximum-likelihood φ and α for every catalog in one L-BFGS-B call
+
+    The catalogs are independent, so the summed likelihood over all of them is
+    optimized with a block-separable analytic gradient.
+
+    Parameters:
+    -----------
+    counts, support : np.ndarray
+        Output of return_period_counts
+    x0 : tuple of np.ndarray, optional
+        (phi, alpha) to warm-start from, e.g. the fit of the previous detection run
+    table : dict, optional
+        CurveFunctions lookup table for the warm start when x0 is not given
+
+    Returns:
+    --------
+    phi, alpha, nll : np.ndarray
+        Fitted parameters and negative log-likelihood per catalog
+    """
+    ncat = len(counts)
+    phi0, alpha0 = initial_guess(counts, support, table) if x0 is None else x0
+    start = np.column_stack([np.broadcast_to(phi0, (ncat,)), np.broadcast_to(alpha0, (ncat,))])
+    eps = 1e-6
+    bounds = [(eps, 1 - eps), (eps, 1 - eps)] * ncat
+
+    def objective(params):
+        params = params.reshape(ncat, 2)
+        nll, dphi, dalpha = neg_log_likelihood(params[:, 0], params[:, 1], counts, support)
+        return nll.sum(), np.column_stack([dphi, dalpha]).ravel()
+
+    result = minimize(objective, np.clip(start, eps, 1 - eps).ravel(), jac=True, method='L-BFGS-B',
+                      bounds=bounds, options={'ftol': tol, 'gtol': 1e-8, 'maxiter': 1000})
+    params = result.x.reshape(ncat, 2)
+    nll, _, _ = neg_log_likelihood(params[:, 0], params[:, 1], counts, support)
+    return params[:, 0], params[:, 1], nll
+
+@InstrumentFunctions.instrumented
+def fit_catalogs(paths, x0=None, table=None):
+    """
+    Fit φ and α for ReturnPeriods catalogs named {region}_{season}.nc
+
+    Parameters:
+    -----------
+    paths : array-like of str
+        Catalog paths, any (nested) shape, e.g. rows of region/season by dataset columns
+
+    Returns:
+    --------
+    phi, alpha : np.ndarray
+        Fitted values with the shape of paths
+    """
+    paths = np.asarray(paths)
+    return_periods, season_days = [], []
+    for path in paths.ravel():
+        season = os.path.splitext(os.path.basename(path))[0].split('_')[-1]
+        with xr.open_dataset(path) as ds:
+            return_periods.append(ds.return_period.values)
+        season_days.append(BlockingDetectionFunctions.season_length(season))
+
+    counts, support = return_period_counts(return_periods, season_days)
+    if x0 is not None:
+        x0 = tuple(np.ravel(v) for v in x0)
+    phi, alpha, _ = fit_curves(counts, support, x0, table)
+    return phi.reshape(paths.shape), alpha.reshape(paths.shape)
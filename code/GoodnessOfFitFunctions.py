@@ -0,0 +1,179 @@
+'''
+Goodness-of-fit code: KS and χ² distances of return-period catalogs from their fitted curves, with parametric-bootstrap p-values
+'''
+import os
+import numpy as np
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+import BlockingDetectionFunctions
+import CurveFunctions
+import EventStoreFunctions
+import FitFunctions
+import InstrumentFunctions
+
+basepath = os.path.expanduser("~/Github")
+result_path = f"{basepath}/data/GoodnessOfFit.nc"
+
+def curve_pmf(phi, alpha, support):
+    '''(ncat, nx) fitted curve of each catalog as a probability mass on its support'''
+    y = CurveFunctions.recurrence_curve(phi, alpha, np.arange(support.shape[-1])) * support
+    return y / y.sum(axis=-1, keepdims=True)
+
+def chi2_bins(pmf, n, min_expected=5, max_bins=20):
+    """
+    Bins of about equal probability under the fitted curve, for the χ² distance
+
+    Parameters:
+    -----------
+    pmf : np.ndarray
+        (nx,) fitted curve of one catalog
+    n : int
+        Number of return periods of the catalog; nbin = n // min_expected, 2 to max_bins
+
+    Returns:
+    --------
+    onehot : np.ndarray
+        (nx, nbin) bin membership of each return period
+    """
+    nbin = int(np.clip(n // min_expected, 2, max_bins))
+    middle = np.cumsum(pmf) - pmf / 2
+    index = np.minimum((middle * nbin).astype(int), nbin - 1)
+    onehot = np.zeros((len(pmf), nbin))
+    onehot[np.arange(len(pmf)), index] = 1
+    return onehot[:, onehot.sum(axis=0) > 0]
+
+def distances(counts, pmf, onehot):
+    """
+    KS and χ² distances of return-period counts from curves, vectorized over rows
+
+    Parameters:
+    -----------
+    counts, pmf : np.ndarray
+        (..., nx) observed counts and fitted curves
+    onehot : np.ndarray
+        (nx, nbin) from chi2_bins
+
+    Returns:
+    --------
+    ks, chi2 : np.ndarray
+        Largest CDF difference and Pearson χ² of the binned counts, shape (...)
+    """
+    n = counts.sum(axis=-1, keepdims=True)
+    ks = np.abs(np.cumsum(counts, axis=-1) / n - np.cumsum(pmf, axis=-1)).max(axis=-1)
+    observed = counts @ onehot
+    expected = n * (pmf @ onehot)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = np.where(expected > 0, (observed - expected)**2 / expected, 0).sum(axis=-1)
+    return ks, chi2
+
+def _bootstrap_batch(job):
+    '''one task: draw synthetic catalogs from a fitted curve, refit them and return their distances'''
+    rng = np.random.default_rng(job['seed'])
+    pmf, support = job['pmf'], job['support']
+    counts = rng.multinomial(job['n'], pmf, size=job['nboot']).astype(float)
+    if job['refit']:
+        nboot = job['nboot']
+        phi, alpha, _ = FitFunctions.fit_curves(counts, np.broadcast_to(support, counts.shape),
+                                                x0=(np.full(nboot, job['phi']), np.full(nboot, job['alpha'])))
+        pmf = curve_pmf(phi, alpha, support)
+    return distances(counts, pmf, job['onehot'])
+
+@InstrumentFunctions.instrumented
+def goodness_of_fit(return_periods, season_days, nboot=1000, refit=True, seed=0, batch_size=250,
+                    max_workers=None, min_expected=5, max_bins=20):
+    """
+    KS and χ² goodness of fit of the recurrence curve to each catalog, with parametric-bootstrap p-values
+
+    Each catalog is fitted by maximum likelihood. Synthetic catalogs of the same size
+    are drawn from the fitted curve as multinomial counts, a batch at a time, and refitted
+    so the null distribution includes the estimation of φ and α. Batches run on a process
+    pool, one SeedSequence child per batch, so results do not depend on max_workers.
+
+    Parameters:
+    -----------
+    return_periods : list of array-like
+        return_period values of each catalog
+    season_days : int or array-like
+        Season length of each catalog, the curve support is 1..season_days-1
+    nboot : int, default=1000
+        Synthetic catalogs per observed catalog
+    refit : bool, default=True
+        Refit φ and α of every synthetic catalog; False compares them with the observed fit
+    batch_size : int, default=250
+        Synthetic catalogs per task, fitted jointly
+    max_workers : int, optional
+        Process pool size, 1 runs in this process
+
+    Returns:
+    --------
+    dict
+        Arrays (ncat,): 'phi', 'alpha', 'n', 'ks', 'ks_p', 'chi2', 'chi2_p', 'nbin'
+    """
+    counts, support = FitFunctions.return_period_counts(return_periods, season_days)
+    phi, alpha, _ = FitFunctions.fit_curves(counts, support)
+    pmf = curve_pmf(phi, alpha, support)
+    n = counts.sum(axis=1).astype(int)
+    onehot = [chi2_bins(p, k, min_expected, max_bins) for p, k in zip(pmf, n)]
+    observed = [distances(c, p, o) for c, p, o in zip(counts, pmf, onehot)]
+
+    nbatch = -(-nboot // batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(counts) * nbatch)
+    jobs = [{'catalog': c, 'pmf': pmf[c], 'support': support[c], 'n': n[c], 'phi': phi[c], 'alpha': alpha[c],
+             'onehot': onehot[c], 'refit': refit, 'seed': seeds[c * nbatch + b],
+             'nboot': min(batch_size, nboot - b * batch_size)}
+            for c in range(len(counts)) for b in range(nbatch) if n[c] > 0]
+    if max_workers == 1:
+        results = [_bootstrap_batch(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(_bootstrap_batch, jobs))
+
+    # p = (1 + exceedances) / (1 + nboot), counted over the batches of each catalog
+    exceed = np.zeros((len(counts), 2))
+    for job, (ks, chi2) in zip(jobs, results):
+        c = job['catalog']
+        exceed[c] += [np.sum(ks >= observed[c][0]), np.sum(chi2 >= observed[c][1])]
+    with np.errstate(invalid='ignore'):
+        ks_p, chi2_p = np.where(n[:, None] > 0, (1 + exceed) / (1 + nboot), np.nan).T
+
+    return {
+        'phi': phi, 'alpha': alpha, 'n': n,
+        'ks': np.array([o[0] for o in observed]), 'ks_p': ks_p,
+        'chi2': np.array([o[1] for o in observed]), 'chi2_p': chi2_p,
+        'nbin': np.array([o.shape[1] for o in onehot]),
+    }
+
+def catalog_goodness_of_fit(files=None, **kwargs):
+    """
+    Goodness of fit of every ReturnPeriods catalog
+
+    Parameters:
+    -----------
+    files : list of tuple, optional
+        (path, dataset, region, season, member), defaults to the ReturnPeriods files of
+        EventStoreFunctions.catalog_files()
+    **kwargs
+        Passed to goodness_of_fit
+
+    Returns:
+    --------
+    xarray.Dataset
+        goodness_of_fit results on dim catalog, with dataset, region and season coordinates
+    """
+    files = [f for f in EventStoreFunctions.catalog_files() if f[1] != "ERA5-yearly"] if files is None else files
+    return_periods = []
+    for path, *_ in files:
+        with xr.open_dataset(path) as ds:
+            return_periods.append(ds['return_period'].values)
+    season_days = [BlockingDetectionFunctions.season_length(f[3]) for f in files]
+    result = goodness_of_fit(return_periods, season_days, **kwargs)
+    return xr.Dataset(
+        {name: ('catalog', values) for name, values in result.items()},
+        coords={'dataset': ('catalog', [f[1] for f in files]), 'region': ('catalog', [f[2] for f in files]),
+                'season': ('catalog', [f[3] for f in files])},
+    )
+
+if __name__ == "__main__":
+    result = catalog_goodness_of_fit(nboot=10000)
+    result.to_netcdf(result_path)
+    InstrumentFunctions.log(result.to_dataframe().round(3).to_string())
@@ -0,0 +1,118 @@
+'''
+Return-period histogram code: integer-day counts of every dataset, region, season and member catalog in one cube
+'''
+import os
+import numpy as np
+import xarray as xr
+import EventStoreFunctions
+import InstrumentFunctions
+
+basepath = os.path.expanduser("~/Github")
+cube_path = f"{basepath}/data/EventStore/return_period_histograms.npz"
+KEYS = ('dataset', 'region', 'season', 'member')
+
+def value_counts(values, max_days=92):
+    '''counts of integer return periods 0..max_days, longer or negative ones are left out'''
+    values = np.asarray(values)
+    values = values[np.isfinite(values)].astype(int)
+    return np.bincount(values[(values >= 0) & (values <= max_days)], minlength=max_days + 1)
+
+def catalog_files():
+    '''(path, dataset, region, season, member) of the ReturnPeriods catalogs, the cube's sources'''
+    return [f for f in EventStoreFunctions.catalog_files() if f[1] != "ERA5-yearly"]
+
+def _sources(files):
+    '''path, modification time and size of each catalog, to tell when the cube is stale'''
+    stats = [os.stat(f[0]) for f in files]
+    return {'source_path': np.array([f[0] for f in files], dtype=str),
+            'source_mtime': np.array([s.st_mtime_ns for s in stats], dtype=np.int64),
+            'source_size': np.array([s.st_size for s in stats], dtype=np.int64)}
+
+@InstrumentFunctions.instrumented
+def catalog_histograms(files=None, max_days=92, path=cube_path):
+    """
+    Return-period counts of every catalog, binned from its own return_period variable, and save them
+
+    Parameters:
+    -----------
+    files : list of tuple, optional
+        (path, dataset, region, season, member), defaults to catalog_files()
+    max_days : int, default=92
+        Longest return period kept, the longest season
+
+    Returns:
+    --------
+    dict
+        Key arrays (nkey,) 'dataset', 'region', 'season', 'member', 'counts' (nkey, max_days+1),
+        'intervals' all intervals of the key including longer ones, 'events' and the
+        source_* arrays of the catalogs
+    """
+    files = catalog_files() if files is None else files
+    counts, intervals, events = [], [], []
+    for f in files:
+        with xr.open_dataset(f[0]) as ds:
+            return_period = ds['return_period'].values
+            events.append(ds.sizes['event'])
+        counts.append(value_counts(return_period, max_days))
+        intervals.append(int(np.sum(return_period >= 0)))
+
+    cube = {name: np.array([f[i + 1] for f in files], dtype=int if name == 'member' else str)
+            for i, name in enumerate(KEYS)}
+    cube['counts'] = np.array(counts, dtype=np.int32).reshape(len(files), max_days + 1)
+    cube['intervals'] = np.array(intervals, dtype=int)
+    cube['events'] = np.array(events, dtype=int)
+    cube.update(_sources(files))
+    if path is not None:
+        # Write next to the cube and swap it in, so jobs loading it never read a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **cube)
+        os.replace(tmp, path)
+    return cube
+
+def _is_current(cube, files):
+    sources = _sources(files)
+    return all(name in cube and np.array_equal(cube[name], sources[name]) for name in sources)
+
+def load_cube(path=cube_path, files=None):
+    '''the saved cube, rebuilt when it is missing or any catalog was added, removed or changed since'''
+    files = catalog_files() if files is None else files
+    if os.path.exists(path):
+        with np.load(path) as f:
+            cube = {name: f[name] for name in f.files}
+        if _is_current(cube, files):
+            return cube
+    return catalog_histograms(files, path=path)
+
+def histogram(cube, dataset, region, season, member=None, max_days=None):
+    """
+    Counts of one dataset, region and season
+
+    Parameters:
+    -----------
+    member : int, optional
+        Ensemble member, all members summed when None
+    max_days : int, optional
+        Keep return periods 0..max_days, e.g. season_days
+
+    Returns:
+    --------
+    x, counts : np.ndarray
+        Return periods (day) and their counts
+    events : int
+        Number of events of the selection
+    """
+    rows = (cube['dataset'] == dataset) & (cube['region'] == region) & (cube['season'] == season)
+    if member is not None:
+        rows &= cube['member'] == member
+    counts = cube['counts'][rows].sum(axis=0)
+    counts = counts if max_days is None else counts[:max_days + 1]
+    return np.arange(len(counts)), counts, int(cube['events'][rows].sum())
+
+def density(counts):
+    '''probability density of integer-day counts, bins of one day'''
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, counts / total, 0)
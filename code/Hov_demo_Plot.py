@@ -11,64 +11,65 @@ import xarray as xr
 import cftime
 import pandas as pd
 import BlockingDetectionFunctions 
+import InstrumentFunctions
 
 def date(YEAR, season, time_format):
     """
     Accommodate both cftime & datetime formats
     """
     if "cftime" in str(time_format):
-        print("cftime")
+        InstrumentFunctions.log("cftime", level=2)
         date1 = cftime.DatetimeNoLeap(YEAR, 6, 1) if season == "JJA" else cftime.DatetimeNoLeap(YEAR, 12, 1)
         date2 = cftime.DatetimeNoLeap(YEAR, 8, 31) if season == "JJA" else cftime.DatetimeNoLeap(YEAR + 1, 2, 28)
     else:
-        print("datetime")
+        InstrumentFunctions.log("datetime", level=2)
         date1 = np.datetime64(str(YEAR)+"-06-01") if season == "JJA" else np.datetime64(str(YEAR)+"-12-01")
         date2 = np.datetime64(str(YEAR)+"-08-31") if season == "JJA" else np.datetime64(str(YEAR+1)+"-02-28")
     return date1, date2
 
+@InstrumentFunctions.instrumented
 def data_filter(ds, region, season, YEAR, time_name, lat_name, lon_name, apply_lat_filter=True):
-    time_format = type(ds.time.values[0])
-    print(f"Time format: {time_format}")
-
-    date1, date2  = date(YEAR, season, time_format)
-
-    ds = ds.where((ds[time_name] >= date1) & (ds[time_name] <= date2), drop=True)
-    ds = ds.sortby(time_name)
-
-    Lon1, Lon2, Lat1, Lat2  = BlockingDetectionFunctions.Region_ERA(region+" "+season, apply_lat_filter)
-    longitude, latitude = ds[lon_name], ds[lat_name]  
-
-    region_condition = xr.where(
-    ((Lon1 <= Lon2) & (Lon1 <= longitude) & (longitude <= Lon2) & (Lat1 <= latitude) & (latitude <= Lat2)) |
-    ((Lon1 > Lon2) & ((Lon1 <= longitude) | (longitude <= Lon2)) & (Lat1 <= latitude) & (latitude <= Lat2)),
-    True, False)
-
-    filtered_ds = ds.where(region_condition, drop=True)
+    # Season window from cached calendar offsets, already in time order
+    seasons = BlockingDetectionFunctions.season_ranges(ds[time_name].values, season)
+    time_index = seasons.get(YEAR, slice(0, 0))
+    ds = ds.isel({ds[time_name].dims[0]: time_index})
+
+    if lon_name in ds.dims and lat_name in ds.dims:
+        # Gridded fields: precomputed index slices, subset lazily
+        filtered_ds = BlockingDetectionFunctions.subset_region(ds, region+" "+season, lon_name, lat_name,
+                                                               lat_filter=apply_lat_filter)
+    else:
+        # Event catalogs: keep events whose position is inside the region
+        box = BlockingDetectionFunctions.Region_ERA(region+" "+season, apply_lat_filter)
+        inside = BlockingDetectionFunctions.in_region(ds[lon_name].values, ds[lat_name].values, box)
+        filtered_ds = ds.isel({ds[lon_name].dims[0]: np.flatnonzero(inside)})
 
     return filtered_ds
 
+@InstrumentFunctions.instrumented
 def lon_fix(lon, lwa, event_lon, region, season):
     Lon1, Lon2, _, _ = BlockingDetectionFunctions.Region_ERA(region + " " + season)
 
     if lon.shape[0] != lwa.shape[1]:
-        print("lon & data have mismatched shapes")
+        InstrumentFunctions.log("lon & data have mismatched shapes")
         return lon, lwa  
 
     if (lon.diff(dim="lon").min() < 0).item():
-        print("lon is not in ascending order")
+        InstrumentFunctions.log("lon is not in ascending order")
 
     if Lon1 > Lon2:  
-        print(f"original lon: {lon}")
+        InstrumentFunctions.log(f"original lon: {lon}", level=2)
         shift = np.abs(lon - Lon2).argmin()+1
         lon = np.roll(lon, -shift)
         lon = (lon + 180) % 360 - 180
         lwa = np.roll(lwa, -shift, axis=1)
-        print(f"lon_fix: {lon}")
+        InstrumentFunctions.log(f"lon_fix: {lon}", level=2)
         event_lon = (event_lon + 180) % 360 - 180
     return lon, lwa, event_lon
 
+@InstrumentFunctions.instrumented
 def load_ERA(basepath, H, season, region, YEAR):
-    LWApath = f"/Users/kaying/Github/data/ERA5/LWA_{region}_{season}_{YEAR}.nc"
+    LWApath = f"{basepath}/data/ERA5/LWA_{region}_{season}_{YEAR}.nc"
     blockpath = f"{basepath}/data/ERA5/BlockingEvents/BlockingEvents_{region}_{season}_{YEAR}.nc"
 
     ds_block = xr.open_dataset(blockpath)
@@ -81,11 +82,12 @@ def load_ERA(basepath, H, season, region, YEAR):
 
     return ds_block, ds_LWA, nBlock, data
 
+@InstrumentFunctions.instrumented
 def plot_lwa_hovmoller(ds_LWA, ds_block, nBlock, YEAR, region, season, data, lon_fix, savingpath=None):
     if nBlock <= 0:
         return  # Exit early if no blocks
 
-    print(f"{nBlock} blocks around the globe in {YEAR} {region}")
+    InstrumentFunctions.log(f"{nBlock} blocks around the globe in {YEAR} {region}")
 
     # Zonal Mean
     ds_LWA = ds_LWA.sortby("time")
@@ -120,14 +122,8 @@ def plot_lwa_hovmoller(ds_LWA, ds_block, nBlock, YEAR, region, season, data, lon
 
     # Prepare and plot block onset matrix
     block_array = np.zeros(len(PlotDate), dtype=bool)
-    for block_date in BlockDate:
-
-        closest_idx = np.argmin(np.abs(
-        (PlotDate.values if hasattr(PlotDate, 'values') else PlotDate) - 
-        (block_date.values if hasattr(block_date, 'values') else block_date)))
-    
-        if closest_idx < len(block_array):
-            block_array[closest_idx] = True
+    _, closest_idx, _ = BlockingDetectionFunctions.map_events_to_timeline(PlotDate, BlockDate)
+    block_array[closest_idx] = True
     block_array_2d = block_array.reshape(-1, 1)
 
     im = ax2.imshow(
@@ -149,9 +145,10 @@ def plot_lwa_hovmoller(ds_LWA, ds_block, nBlock, YEAR, region, season, data, lon
         plt.savefig(f"{savingpath}/{region}_{season}.png", dpi=600)
 
 #%% main code
-basepath = os.path.expanduser("~/Github")
-savingpath = f'{basepath}/plots/Hov_demo'
-os.makedirs(savingpath, exist_ok=True)
-YEAR, season, region, region_name, H = 1990, "DJF", "Atlantic", "Northern Atlantic", "NH"
-ds_block, ds_LWA, nBlock, data = load_ERA(basepath, H, season, region, YEAR)
-plot_lwa_hovmoller(ds_LWA, ds_block, nBlock, YEAR, region, season, data, lon_fix, savingpath)
+if __name__ == "__main__":
+    basepath = os.path.expanduser("~/Github")
+    savingpath = f'{basepath}/plots/Hov_demo'
+    os.makedirs(savingpath, exist_ok=True)
+    YEAR, season, region, region_name, H = 1990, "DJF", "Atlantic", "Northern Atlantic", "NH"
+    ds_block, ds_LWA, nBlock, data = load_ERA(basepath, H, season, region, YEAR)
+    plot_lwa_hovmoller(ds_LWA, ds_block, nBlock, YEAR, region, season, data, lon_fix, savingpath)
@@ -0,0 +1,153 @@
+'''
+Hovmöller stack code: latitude-mean LWA of every season year and region in one chunked array
+'''
+import os
+import glob
+import numpy as np
+import xarray as xr
+import BlockingDetectionFunctions
+import InstrumentFunctions
+
+basepath = os.path.expanduser("~/Github")
+stack_folder = f"{basepath}/data/ERA5/Hovmoller"
+
+def recentered_slices(lon, lon_slices, region, dataset="ERA"):
+    """
+    Longitude slices of a region in plotting order, and their recentered longitudes
+
+    A box across 0° (e.g. Atlantic DJF, 330°-30°) is two runs of the grid; they are
+    returned east of Lon1 first, so reading them in order gives a continuous axis
+    without rolling a copy of the field.
+
+    Parameters:
+    -----------
+    lon_slices : list of slice
+        region_index(...)['lon_slices'], runs of the box in grid order
+
+    Returns:
+    --------
+    slices : list of slice
+        Grid slices in plotting order
+    lon : np.ndarray
+        Recentered longitudes, -180..180 when the box wraps
+    """
+    lon = np.asarray(lon)
+    Lon1, Lon2, _, _ = BlockingDetectionFunctions.region_box(region, dataset)
+    slices = sorted(lon_slices, key=lambda s: (lon[s.start] - Lon1) % 360)
+    lons = np.concatenate([lon[s] for s in slices]) if slices else np.array([])
+    if Lon1 > Lon2:
+        lons = (lons + 180) % 360 - 180
+    return slices, lons
+
+def season_day(times, season):
+    '''position of each day in its season, 0 on 1 Dec (DJF) or 1 Jun (JJA), 29 Feb left out'''
+    fields = BlockingDetectionFunctions.calendar_fields(times)
+    first = {"DJF": {12: 0, 1: 31, 2: 62}, "JJA": {6: 0, 7: 30, 8: 61}}[season]
+    offset = np.array([first.get(m, -1) for m in range(13)])
+    return offset[fields['month']] + fields['day'] - 1
+
+def season_hovmoller(ds, time_index, lat_slice, lon_slices, out, var_name="LWA",
+                     time_name="time", lat_name="lat", lon_name="lon"):
+    '''latitude mean of one season, written run by run into out (ndays, nlon) without an intermediate roll'''
+    column = 0
+    for s in lon_slices:
+        field = ds[var_name].isel({time_name: time_index, lat_name: lat_slice, lon_name: s})
+        width = s.stop - s.start
+        out[:, column:column + width] = field.transpose(time_name, lat_name, lon_name).values.mean(axis=1)
+        column += width
+    return out
+
+@InstrumentFunctions.instrumented
+def build_stack(paths, regions, season, dataset="ERA", var_name="LWA", dtype=np.float32,
+                time_name="time", lat_name="lat", lon_name="lon"):
+    """
+    Hovmöller arrays of every season year and region, in one pass over the LWA files
+
+    Each season is read once per region as contiguous hyperslabs of the region's
+    latitude band and longitude runs, averaged over latitude and written straight into
+    the stack in recentered order. A paths dict gives per-region files, as the
+    LWA_{region}_{season}_{YEAR}.nc layout; a list is read for every region.
+
+    Parameters:
+    -----------
+    paths : list of str, or dict
+        LWA files with (time, lat, lon) variable var_name, or {region: list of files}
+    regions : list of str
+        e.g. ["Atlantic", "Pacific"]
+    season : str
+        "DJF" or "JJA"
+
+    Returns:
+    --------
+    xarray.Dataset
+        var_name (region, year, day, x), NaN outside the record and past narrower boxes;
+        time (region, year, day) dates and lon (region, x) recentered longitudes
+    """
+    season_days = BlockingDetectionFunctions.season_length(season)
+    panels = {}
+    for region in regions:
+        for path in paths[region] if isinstance(paths, dict) else paths:
+            ds = xr.open_dataset(path)
+            lon, lat = ds[lon_name].values, ds[lat_name].values
+            index = BlockingDetectionFunctions.region_index(lon, lat, f"{region} {season}", dataset)
+            slices, lons = recentered_slices(lon, index['lon_slices'], f"{region} {season}", dataset)
+            times = ds[time_name].values
+            for YEAR, time_index in BlockingDetectionFunctions.season_ranges(times, season).items():
+                # Seasons cut by the ends of the record keep their days at their place in the season
+                days = season_day(times[time_index], season)
+                panel = np.full((season_days, len(lons)), np.nan, dtype=dtype)
+                panel[days] = season_hovmoller(ds, time_index, index['lat'], slices, np.empty((len(days), len(lons)), dtype),
+                                               var_name, time_name, lat_name, lon_name)
+                dates = np.full(season_days, np.datetime64('NaT'), dtype='datetime64[D]')
+                dates[days] = BlockingDetectionFunctions.to_datetime64(times[time_index], 'D')
+                panels[region, YEAR] = (panel, dates, lons)
+            ds.close()
+            InstrumentFunctions.log(f"{region} {season}: {os.path.basename(path)}", level=2)
+
+    years = sorted({YEAR for _, YEAR in panels})
+    width = max([len(p[2]) for p in panels.values()], default=0)
+    stack = np.full((len(regions), len(years), season_days, width), np.nan, dtype=dtype)
+    dates = np.full(stack.shape[:3], np.datetime64('NaT'), dtype='datetime64[D]')
+    lons = np.full((len(regions), width), np.nan)
+    for (region, YEAR), (panel, panel_dates, panel_lons) in panels.items():
+        r, y = regions.index(region), years.index(YEAR)
+        stack[r, y, :, :panel.shape[1]] = panel
+        dates[r, y] = panel_dates
+        lons[r, :len(panel_lons)] = panel_lons
+
+    return xr.Dataset(
+        {var_name: (('region', 'year', 'day', 'x'), stack)},
+        coords={'region': list(regions), 'year': years, 'day': np.arange(season_days),
+                'time': (('region', 'year', 'day'), dates.astype('datetime64[ns]')),
+                'lon': (('region', 'x'), lons)},
+        attrs={'season': season, 'dataset': dataset},
+    )
+
+def write_stack(stack, path, var_name="LWA"):
+    '''write a stack as NetCDF, one compressed chunk per region and season year'''
+    _, _, ndays, width = stack[var_name].shape
+    encoding = {var_name: {'chunksizes': (1, 1, ndays, max(width, 1)), 'zlib': True, 'complevel': 4}}
+    tmp = f"{path}.tmp"
+    stack.to_netcdf(tmp, encoding=encoding)
+    os.replace(tmp, path)
+
+def open_stack(path):
+    '''lazily opened stack, selecting a region and year reads only its chunk'''
+    return xr.open_dataset(path)
+
+def hovmoller(stack, region, YEAR, var_name="LWA"):
+    '''(dates, lon, values) of one region and season year, days and columns outside the record dropped'''
+    panel = stack.sel(region=region, year=YEAR)
+    dates = panel['time'].values
+    lon = panel['lon'].values
+    days, columns = ~np.isnat(dates), np.isfinite(lon)
+    return dates[days], lon[columns], panel[var_name].values[days][:, columns]
+
+if __name__ == "__main__":
+    os.makedirs(stack_folder, exist_ok=True)
+    for season in ["DJF", "JJA"]:
+        regions = ["Atlantic", "Pacific"]
+        paths = {region: sorted(glob.glob(f"{basepath}/data/ERA5/LWA_{region}_{season}_*.nc")) for region in regions}
+        regions = [region for region in regions if paths[region]]
+        if regions:
+            write_stack(build_stack(paths, regions, season), f"{stack_folder}/Hovmoller_{season}.nc")
@@ -0,0 +1,190 @@
+'''
+Instrumentation code: per-stage wall time, CPU time, RSS and array bytes, with leveled log messages
+Settings (environment):
+    GRL_VERBOSITY  0 silent, 1 messages (default), 2 messages and one line per finished stage
+    GRL_REPORT     write the stage records at exit, .json or .csv
+    GRL_TRACE      write a Chrome trace event file at exit (chrome://tracing, Perfetto)
+    GRL_RECORDS    stage records kept for the report and trace, the most recent (default 10000);
+                   the per-stage summary counts every call
+'''
+import os
+import csv
+import json
+import time
+import atexit
+import resource
+import functools
+import collections
+import threading
+import contextlib
+import multiprocessing
+import numpy as np
+
+VERBOSITY = int(os.environ.get("GRL_VERBOSITY", 1))
+
+MAX_RECORDS = int(os.environ.get("GRL_RECORDS", 10000))
+
+_records = collections.deque(maxlen=MAX_RECORDS)
+_totals = {}
+_lock = threading.Lock()
+_local = threading.local()
+# Shared by spawned workers through the environment, so merged records line up on one time axis
+_origin = float(os.environ.setdefault("GRL_ORIGIN", repr(time.time())))
+
+def set_verbosity(level):
+    '''0 silent, 1 messages, 2 messages and stage timings'''
+    global VERBOSITY
+    VERBOSITY = level
+
+def log(message, level=1):
+    '''print a diagnostic message if the verbosity setting allows it'''
+    if VERBOSITY >= level:
+        print(message)
+
+def _peak_rss_mb():
+    '''largest RSS of the process so far'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+def _rss_mb():
+    '''current RSS of the process, the peak where /proc is not available'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return _peak_rss_mb()
+
+def array_bytes(value):
+    '''bytes held by numpy arrays and xarray objects in a value, looking one level into containers'''
+    if isinstance(value, (tuple, list)):
+        return sum(array_bytes(v) for v in value if not isinstance(v, (tuple, list, dict)))
+    if isinstance(value, dict):
+        return sum(array_bytes(v) for v in value.values() if not isinstance(v, (tuple, list, dict)))
+    return int(getattr(value, 'nbytes', 0)) if isinstance(getattr(value, 'nbytes', None), (int, np.integer)) else 0
+
+@contextlib.contextmanager
+def instrument(name, **tags):
+    """
+    Record the cost of a block as one stage
+
+    Yields a dict; set 'bytes' in it to report the arrays the block produced.
+
+    Parameters:
+    -----------
+    name : str
+        Stage name, e.g. "Comp_LWA.load_data"
+    **tags
+        Extra fields kept with the record, e.g. region="Atlantic"
+    """
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    record = {'name': name, 'bytes': 0, 'depth': depth, 'pid': os.getpid(), 'thread': threading.get_ident()}
+    record.update(tags)
+    rss0 = _rss_mb()
+    record['start_s'] = time.time() - _origin
+    start, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - start
+        record['cpu_s'] = time.process_time() - cpu
+        record['peak_rss_mb'] = _peak_rss_mb()
+        record['rss_mb'] = _rss_mb()
+        record['rss_growth_mb'] = record['rss_mb'] - rss0
+        _local.depth = depth
+        with _lock:
+            _records.append(record)
+            _aggregate(_totals, record)
+        log(f"{'  '*depth}{name}: {record['wall_s']:.3f} s wall, {record['cpu_s']:.3f} s cpu, "
+            f"{record['peak_rss_mb']:.0f} MB peak RSS, {record['bytes']/2**20:.1f} MB arrays", level=2)
+
+def instrumented(func=None, name=None):
+    '''decorator recording every call of a function as a stage, with the bytes of its result'''
+    if func is None:
+        return functools.partial(instrumented, name=name)
+    stage_name = name or f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with instrument(stage_name) as record:
+            result = func(*args, **kwargs)
+            record['bytes'] = array_bytes(result)
+        return result
+    return wrapper
+
+def records():
+    '''copy of the most recent MAX_RECORDS stage records of this process'''
+    with _lock:
+        return [dict(r) for r in _records]
+
+def clear():
+    with _lock:
+        _records.clear()
+        _totals.clear()
+
+def take():
+    '''stage records of this process, removed from it; a pool worker returns them to the parent'''
+    with _lock:
+        rows = list(_records)
+        _records.clear()
+        _totals.clear()
+    return rows
+
+def merge(rows):
+    '''add stage records of another process, e.g. from take() in a worker, to this one's'''
+    with _lock:
+        for r in rows:
+            _records.append(r)
+            _aggregate(_totals, r)
+
+def _aggregate(table, r):
+    s = table.setdefault(r['name'], {'name': r['name'], 'calls': 0, 'wall_s': 0.0, 'max_wall_s': 0.0,
+                                     'cpu_s': 0.0, 'peak_rss_mb': 0.0, 'bytes': 0})
+    s['calls'] += 1
+    s['wall_s'] += r['wall_s']
+    s['max_wall_s'] = max(s['max_wall_s'], r['wall_s'])
+    s['cpu_s'] += r['cpu_s']
+    s['peak_rss_mb'] = max(s['peak_rss_mb'], r['peak_rss_mb'])
+    s['bytes'] = max(s['bytes'], r['bytes'])
+
+def summary(rows=None):
+    '''per-stage calls, total and max wall time, total CPU time, max peak RSS and array bytes, of every call by default'''
+    if rows is None:
+        with _lock:
+            table = {name: dict(s) for name, s in _totals.items()}
+    else:
+        table = {}
+        for r in rows:
+            _aggregate(table, r)
+    return sorted(table.values(), key=lambda s: -s['wall_s'])
+
+FIELDS = ['name', 'start_s', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rss_mb', 'rss_growth_mb', 'bytes', 'depth', 'pid', 'thread']
+
+def write_report(path):
+    '''stage records as JSON (records and summary) or CSV (one row per record), by file extension'''
+    rows = records()
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, "w") as f:
+            json.dump({'records': rows, 'summary': summary()}, f, indent=1, default=str)
+
+def write_trace(path):
+    '''stage records as complete events of the Chrome trace format'''
+    events = [{'name': r['name'], 'ph': 'X', 'ts': r['start_s'] * 1e6, 'dur': r['wall_s'] * 1e6,
+               'pid': r['pid'], 'tid': r['thread'],
+               'args': {k: r[k] for k in r if k not in ('name', 'pid', 'thread', 'start_s', 'wall_s')}}
+              for r in records()]
+    with open(path, "w") as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+def _write_at_exit():
+    if os.environ.get("GRL_REPORT"):
+        write_report(os.environ["GRL_REPORT"])
+    if os.environ.get("GRL_TRACE"):
+        write_trace(os.environ["GRL_TRACE"])
+
+if multiprocessing.parent_process() is None:  # workers hand their records to the parent, see take()
+    atexit.register(_write_at_exit)
@@ -0,0 +1,363 @@
+'''
+Figure pipeline code: stages with explicit inputs, a content-hashed artifact cache and a command line runner
+'''
+import os
+import sys
+import json
+import glob
+import pickle
+import fnmatch
+import hashlib
+import argparse
+import ast
+import inspect
+import textwrap
+import numpy as np
+import BlockingDetectionFunctions
+import DataAccessFunctions
+import InstrumentFunctions
+
+code_dir = os.path.dirname(os.path.abspath(__file__))
+basepath = os.path.expanduser("~/Github")
+cache_dir = f"{basepath}/cache/pipeline"
+
+_stages = {}       # name -> stage definition
+_file_hashes = {}  # (path, mtime, size) -> sha256
+_file_imports = {} # (path, mtime, size, top_level) -> imported module names
+
+def stage(name, func, deps=(), files=(), code=(), params=None, outputs=()):
+    """
+    Register a pipeline stage
+
+    The stage result is func(*dep_results, **params). It is cached under a key hashing
+    the stage name, params, the content of its input files and code files, and the keys
+    of its dependencies, so editing one catalog or one script only invalidates the
+    stages downstream of it. Code files are the modules func imports, the modules
+    PipelineFunctions imports at module level and the code files given, each with
+    every code/ module it imports in turn (code_files).
+
+    Parameters:
+    -----------
+    name : str
+        e.g. "catalog:ERA5/Atlantic_DJF"
+    deps : sequence of str
+        Names of the stages whose results are passed to func, in order
+    files : sequence of str
+        Input files read by func
+    code : sequence of str
+        Source files in code/ that func depends on without importing them, e.g. scripts
+        run with runpy
+    params : dict, optional
+        JSON-serializable keyword arguments of func
+    outputs : sequence of str
+        Files written by func, the stage reruns when one of them is missing
+    """
+    modules = _module_paths(_source_imports(textwrap.dedent(inspect.getsource(func))) |
+                            _imports(os.path.join(code_dir, 'PipelineFunctions.py'), top_level=True))
+    _stages[name] = {'func': func, 'deps': tuple(deps), 'files': tuple(files), 'params': dict(params or {}),
+                     'code': tuple(os.path.join(code_dir, c) for c in code) + modules,
+                     'outputs': tuple(outputs)}
+
+def _source_imports(source, top_level=False):
+    '''top-level names of the modules imported in Python source, at module level only or anywhere'''
+    tree = ast.parse(source)
+    names = set()
+    for node in tree.body if top_level else ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+    return names
+
+def _imports(path, top_level=False):
+    '''modules imported by a source file, memoized by path, modification time and size'''
+    info = os.stat(path)
+    key = (os.path.abspath(path), info.st_mtime_ns, info.st_size, top_level)
+    if key not in _file_imports:
+        with open(path) as f:
+            _file_imports[key] = _source_imports(f.read(), top_level)
+    return _file_imports[key]
+
+def _module_paths(names):
+    '''code/ source files of the module names that are repository modules'''
+    paths = (os.path.join(code_dir, f"{name}.py") for name in sorted(names))
+    return tuple(path for path in paths if os.path.exists(path))
+
+def code_files(paths):
+    '''source files and, transitively, every code/ module they import, also inside functions'''
+    found, todo = set(), list(paths)
+    while todo:
+        path = todo.pop()
+        if path in found:
+            continue
+        found.add(path)
+        if os.path.exists(path):
+            todo.extend(_module_paths(_imports(path)))
+    return tuple(sorted(found))
+
+def file_hash(path):
+    '''sha256 of a file, memoized by path, modification time and size'''
+    if not os.path.exists(path):
+        return "missing"
+    info = os.stat(path)
+    key = (os.path.abspath(path), info.st_mtime_ns, info.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+def stage_key(name, keys=None):
+    '''content hash of a stage and, recursively, of everything upstream of it'''
+    keys = {} if keys is None else keys
+    if name not in keys:
+        node = _stages[name]
+        digest = hashlib.sha256(name.encode())
+        digest.update(json.dumps(node['params'], sort_keys=True, default=str).encode())
+        for path in node['files'] + (os.path.join(code_dir, 'PipelineFunctions.py'),) + code_files(node['code']):
+            digest.update(file_hash(path).encode())
+        for dep in node['deps']:
+            digest.update(stage_key(dep, keys).encode())
+        keys[name] = digest.hexdigest()[:20]
+    return keys[name]
+
+def _artifact(name, key, cache):
+    return os.path.join(cache, name.replace(':', '/'), f"{key}.pkl")
+
+def build(name, force=False, cache=None, _keys=None, _built=None):
+    """
+    Result of a stage, from the cache when nothing upstream changed
+
+    Dependencies are only loaded or recomputed when the stage itself has to run.
+
+    Parameters:
+    -----------
+    force : bool, default=False
+        Rerun this stage even if it is cached (dependencies still come from the cache)
+
+    Returns:
+    --------
+    Result of the stage function
+    """
+    cache = cache_dir if cache is None else cache
+    keys = {} if _keys is None else _keys
+    built = {} if _built is None else _built
+    if name in built:
+        return built[name]
+
+    node = _stages[name]
+    key = stage_key(name, keys)
+    path = _artifact(name, key, cache)
+    if not force and os.path.exists(path) and all(os.path.exists(o) for o in node['outputs']):
+        with open(path, "rb") as f:
+            built[name] = pickle.load(f)
+        return built[name]
+
+    inputs = [build(dep, False, cache, keys, built) for dep in node['deps']]
+    InstrumentFunctions.log(f"build {name} [{key}]", level=2)
+    result = node['func'](*inputs, **node['params'])
+
+    # Keep only the current artifact of the stage, written atomically
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for old in glob.glob(os.path.join(os.path.dirname(path), "*.pkl")):
+        os.remove(old)
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp", path)
+    built[name] = result
+    return result
+
+def status(name, cache=None, _keys=None):
+    '''"cached" or "stale" for one stage'''
+    cache = cache_dir if cache is None else cache
+    path = _artifact(name, stage_key(name, _keys), cache)
+    fresh = os.path.exists(path) and all(os.path.exists(o) for o in _stages[name]['outputs'])
+    return "cached" if fresh else "stale"
+
+#%% Stage functions
+def load_catalog(path):
+    '''event onsets, time axis and return periods of a BlockingEvents/ReturnPeriods file'''
+    ds = DataAccessFunctions.open_dataset(path)
+    return {'start_date': np.sort(ds['start_date'].values), 'time': ds['time'].values,
+            'return_period': ds['return_period'].values, 'recurrence': ds['recurrence'].values,
+            'data': str(ds.attrs.get('data', ''))}
+
+def load_phi_ERA(region, season, path):
+    import ERA_red_curve
+    return ERA_red_curve.load_phi(region, season, path)
+
+def load_phi_CESM(data, region, season):
+    import CESM_Hist
+    return CESM_Hist.load_phi(data, region, season)[0]
+
+def curve_CESM(catalog, phi, data, region, season):
+    import CESM_Hist
+    y, max_x, season_days, phi, Pk = CESM_Hist.curve_y(data, region, season, len(catalog['start_date']), phi)
+    return {'y': y, 'max_x': max_x, 'season_days': season_days, 'phi': phi, 'Pk': Pk}
+
+def fit_table(*catalogs, seasons=()):
+    '''φ and α of the table catalogs, fitted jointly, rows of 3 datasets'''
+    import FitFunctions
+    counts, support = FitFunctions.return_period_counts(
+        [catalog['return_period'] for catalog in catalogs],
+        [BlockingDetectionFunctions.season_length(season) for season in seasons])
+    phi, alpha, _ = FitFunctions.fit_curves(counts, support)
+    return {'phi': phi.reshape(-1, 3), 'alpha': alpha.reshape(-1, 3)}
+
+def load_composite(region, regionname, season, Folder):
+    import Comp_LWA
+    Current, Previous, Next, _, _ = Comp_LWA.load_data(region, regionname, season, Folder)
+    return {'Current': Current, 'Previous': Previous, 'Next': Next}
+
+def composite_ttest(composite, block_size, significance_level):
+    import Comp_LWA
+    significant_points = Comp_LWA.significance(composite['Current'], composite['Previous'], composite['Next'],
+                                               block_size, significance_level)
+    return {'significant_points': significant_points, 'block_size': block_size}
+
+def _close(savefile):
+    import matplotlib.pyplot as plt
+    plt.close('all')
+    return savefile
+
+def render_Comp(composite, ttest, regionname, season, seasontime, savefile):
+    import Comp_LWA
+    Comp_LWA.Draw(composite['Current'], composite['Previous'], composite['Next'], ttest['significant_points'],
+                  ttest['block_size'], regionname, season, seasontime, savefile)
+    return _close(savefile)
+
+def render_ERA(catalog_ERA, catalog_red, phi, title, savefile, N=90):
+    '''ERA_red_curve.render from cached catalogs, counts of their return_period as in the histogram cube'''
+    import ERA_red_curve
+    import matplotlib.pyplot as plt
+    import HistogramFunctions
+    Pk_ERA = len(catalog_ERA['start_date']) / len(catalog_ERA['time'])
+    Pk_red = len(catalog_red['start_date']) / len(catalog_red['time'])
+    ERA_red_curve.plot(HistogramFunctions.value_counts(catalog_red['return_period'], N),
+                       HistogramFunctions.value_counts(catalog_ERA['return_period'], N),
+                       Pk_red, Pk_ERA, phi, title, N=N)
+    plt.savefig(savefile, dpi=600)
+    return _close(savefile)
+
+def render_CESM(catalog_Hist, curve_Hist, catalog_RCP, curve_RCP, region_name, season, savefile):
+    import CESM_Hist
+    import HistogramFunctions
+    season_days = curve_Hist['season_days']
+    Count_Hist = HistogramFunctions.value_counts(catalog_Hist['return_period'], season_days)
+    Count_RCP = HistogramFunctions.value_counts(catalog_RCP['return_period'], season_days)
+    CESM_Hist.Draw_with_theo_curve(Count_Hist, curve_Hist['y'], curve_Hist['phi'], curve_Hist['Pk'],
+                                   Count_RCP, curve_RCP['y'], curve_RCP['phi'], curve_RCP['Pk'],
+                                   season_days, region_name, season, savefile)
+    return _close(savefile)
+
+def render_table(fit, savefile):
+    import table
+    table.Plot_table(fit['phi'], fit['alpha'], savefile)
+    return _close(savefile)
+
+def render_script(script, savefile):
+    import runpy
+    runpy.run_path(os.path.join(code_dir, script), run_name="__main__")
+    return _close(savefile)
+
+#%% Figure stages
+def register_figures():
+    '''declare the stages of every figure of the repository'''
+    regions = ["Pacific", "Atlantic", "BAM"]
+    names = ["Northern Pacific", "Northern Atlantic", "Southern Pacific"]
+    hemispheres = ["NH", "NH", "SH"]
+    seasons = ["DJF", "JJA"]
+    catalog_folders = {
+        "ERA5": f"{basepath}/data/ERA5/BlockingEvents/ReturnPeriods",
+        "Red_noise": f"{basepath}/data/Red_noise/BlockingEvents/ReturnPeriods",
+        "CESM1-Hist": f"{basepath}/data/CESM1/BlockingEvents/ReturnPeriods/Hist",
+        "CESM1-RCP": f"{basepath}/data/CESM1/BlockingEvents/ReturnPeriods/RCP",
+    }
+
+    for region, name, H in zip(regions, names, hemispheres):
+        for season in seasons:
+            rs = f"{region}_{season}"
+            for dataset, folder in catalog_folders.items():
+                stage(f"catalog:{dataset}/{rs}", load_catalog, files=[f"{folder}/{rs}.nc"],
+                      params={'path': f"{folder}/{rs}.nc"})
+
+            phi_file = f"{basepath}/data/Red_noise/red_noise_model/LWA_{H}_{season}.nc"
+            stage(f"phi:ERA5/{rs}", load_phi_ERA, files=[phi_file],
+                  params={'region': region, 'season': season, 'path': phi_file})
+            stage(f"render:ERA/{rs}", render_ERA, deps=[f"catalog:ERA5/{rs}", f"catalog:Red_noise/{rs}", f"phi:ERA5/{rs}"],
+                  params={'title': f"{name} blocks, {season}", 'savefile': f"{basepath}/plots/ERA_Hist/{rs}.png"},
+                  outputs=[f"{basepath}/plots/ERA_Hist/{rs}.png"])
+
+            for data in ["Hist", "RCP"]:
+                phi_file = f"{basepath}/data/CESM1/regional_lwa/{data}/{rs}.nc"
+                stage(f"phi:CESM1-{data}/{rs}", load_phi_CESM, files=[phi_file],
+                      params={'data': data, 'region': region, 'season': season})
+                stage(f"curve:CESM1-{data}/{rs}", curve_CESM, deps=[f"catalog:CESM1-{data}/{rs}", f"phi:CESM1-{data}/{rs}"],
+                      params={'data': data, 'region': region, 'season': season})
+            stage(f"render:CESM/{rs}", render_CESM,
+                  deps=[f"catalog:CESM1-Hist/{rs}", f"curve:CESM1-Hist/{rs}", f"catalog:CESM1-RCP/{rs}", f"curve:CESM1-RCP/{rs}"],
+                  params={'region_name': name, 'season': season, 'savefile': f"{basepath}/plots/CESM_Hist/{rs}.png"},
+                  outputs=[f"{basepath}/plots/CESM_Hist/{rs}.png"])
+
+    # Composites, one season time per panel column
+    Folder = f"{basepath}/data/ERA5/Comp_ERA"
+    for seasontime, seasonlist in zip(["summer", "winter"], [["JJA", "JJA", "DJF"], ["DJF", "DJF", "JJA"]]):
+        for region, name, season in zip(regions, names, seasonlist):
+            rs = f"{region}_{season}"
+            stage(f"composite:{rs}", load_composite,
+                  files=[f"{Folder}/{kind}_{rs}.npy" for kind in ["Current", "Next", "Previous"]],
+                  params={'region': region, 'regionname': name, 'season': season, 'Folder': Folder})
+            stage(f"ttest:{rs}", composite_ttest, deps=[f"composite:{rs}"],
+                  params={'block_size': 2, 'significance_level': 0.01})
+            stage(f"render:Comp/{rs}", render_Comp, deps=[f"composite:{rs}", f"ttest:{rs}"],
+                  params={'regionname': name, 'season': season, 'seasontime': seasontime,
+                          'savefile': f"{basepath}/plots/Comp_LWA/{rs}.png"},
+                  outputs=[f"{basepath}/plots/Comp_LWA/{rs}.png"])
+
+    # Table of fitted φ and α, rows as in table.py
+    row_keys = [(region, season) for region in regions for season in ["JJA", "DJF"]]
+    table_catalogs = [f"catalog:{dataset}/{region}_{season}" for region, season in row_keys
+                      for dataset in ["ERA5", "CESM1-Hist", "CESM1-RCP"]]
+    stage("fit:table", fit_table, deps=table_catalogs,
+          params={'seasons': [season for _, season in row_keys for _ in range(3)]})
+    stage("render:table", render_table, deps=["fit:table"],
+          params={'savefile': f"{basepath}/plots/Fig4/Table.png"}, outputs=[f"{basepath}/plots/Fig4/Table.png"])
+    stage("render:distribution", render_script, code=["distribution.py"],
+          params={'script': "distribution.py", 'savefile': f"{basepath}/plots/Fig4/Distribution.png"},
+          outputs=[f"{basepath}/plots/Fig4/Distribution.png"])
+
+register_figures()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild figure pipeline targets, rerunning only invalidated stages")
+    parser.add_argument("targets", nargs="*", default=["render:*"], help="stage names or patterns, e.g. 'render:Comp/*'")
+    parser.add_argument("--list", action="store_true", help="list matching stages and whether they are cached")
+    parser.add_argument("--force", action="store_true", help="rerun the targets even if cached")
+    parser.add_argument("--cache", default=cache_dir, help="artifact cache directory")
+    args = parser.parse_args(argv)
+
+    names = [name for name in _stages if any(fnmatch.fnmatchcase(name, t) for t in args.targets)]
+    if not names:
+        parser.error(f"no stage matches {' '.join(args.targets)}")
+    keys = {}
+    if args.list:
+        for name in names:
+            print(f"{name:<40} {status(name, args.cache, keys)}")
+        return
+
+    import matplotlib
+    matplotlib.use("Agg")
+    built, failed = {}, []
+    for name in names:
+        try:
+            build(name, args.force, args.cache, keys, built)
+        except Exception as e:
+            failed.append(name)
+            InstrumentFunctions.log(f"failed {name}: {type(e).__name__}: {e}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
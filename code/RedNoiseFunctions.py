@@ -0,0 +1,150 @@
+'''
+Red noise model code: AR(1) LWA surrogates and their blocking event catalogs
+'''
+import numpy as np
+import xarray as xr
+from scipy.stats import norm
+from concurrent.futures import ProcessPoolExecutor
+import BlockingDetectionFunctions
+import EventDetectionFunctions
+import InstrumentFunctions
+
+def ar1_filter(noise, phi, state=None):
+    """
+    Recursive filter x[t] = φ x[t-1] + noise[t] along the last axis, vectorized over longitudes
+
+    Uses a log2(ndays)-step prefix scan, so each longitude can have its own φ.
+
+    Parameters:
+    -----------
+    noise : np.ndarray
+        (nlon, ndays) innovations
+    phi : np.ndarray
+        (nlon,) lag-1 autocorrelation per longitude
+    state : np.ndarray, optional
+        (nlon,) last value of the previous chunk
+
+    Returns:
+    --------
+    series, state : np.ndarray
+        Filtered chunk and its last value, to carry into the next chunk
+    """
+    series = np.array(noise, dtype=float)
+    phi = np.asarray(phi, dtype=float)[:, None]
+    ndays = series.shape[-1]
+
+    shift, coef = 1, phi
+    while shift < ndays:
+        series[:, shift:] += coef * series[:, :-shift]
+        shift, coef = 2*shift, coef**2
+    if state is not None:
+        series += np.asarray(state, dtype=float)[:, None] * phi**np.arange(1, ndays + 1)
+    return series, series[:, -1].copy()
+
+def simulate_ar1(phi, sigma, ndays, chunk_days, rng, mean=0.0):
+    """
+    Stream an AR(1) surrogate of ndays in chunks of chunk_days
+
+    Parameters:
+    -----------
+    phi, sigma, mean : float or np.ndarray
+        Per-longitude lag-1 correlation (temp_corr), standard deviation and mean of LWA
+    rng : np.random.Generator
+
+    Yields:
+    -------
+    np.ndarray
+        (nlon, chunk_days) surrogate LWA, the last chunk may be shorter
+    """
+    phi = np.atleast_1d(np.asarray(phi, dtype=float))
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), phi.shape)
+    mean = np.broadcast_to(np.asarray(mean, dtype=float), phi.shape)
+    scale = np.sqrt(1 - phi**2)[:, None]
+
+    state = rng.standard_normal(phi.shape)  # start from the stationary distribution
+    for start in range(0, ndays, chunk_days):
+        noise = scale * rng.standard_normal((len(phi), min(chunk_days, ndays - start)))
+        anomaly, state = ar1_filter(noise, phi, state)
+        yield mean[:, None] + sigma[:, None] * anomaly
+
+def _simulate_block(args):
+    '''one worker: tracked events of nyears seasons of the (time, lon) AR(1) surrogate'''
+    phi, sigma, mean, threshold, lat, season_days, first_season, nyears, chunk_years, seed = args
+    rng = np.random.default_rng(seed)
+    nlon = len(phi)
+    lat_of_max = np.full((season_days, nlon), lat)
+
+    # Seasons are tracked one by one, so events never run from one season into the next
+    state = EventDetectionFunctions.initial_state(nlon)
+    state['offset'] = first_season * season_days
+    found = []
+    for chunk in simulate_ar1(phi, sigma, nyears * season_days, chunk_years * season_days, rng, mean):
+        for band_mean in chunk.T.reshape(-1, season_days, nlon):
+            closed, state = EventDetectionFunctions.track_chunk(band_mean > threshold, band_mean, lat_of_max, state, False)
+            found.append(closed)
+    found.append({key: state['open'][key] for key in ('start', 'end', 'lon_index', 'lat')})
+    return {key: np.concatenate([f[key] for f in found]) for key in found[0]}
+
+@InstrumentFunctions.instrumented
+def red_noise_catalog(phi, sigma, lon, region, season, nyears, percentile=90, min_duration=5, mean=0.0,
+                      box=None, years_per_block=100, chunk_years=10, seed=0, max_workers=None):
+    """
+    Blocking event catalog of an AR(1) red noise model, in the ReturnPeriods file layout
+
+    Each longitude follows its own AR(1) process with the lag-1 correlation of the
+    temp_corr field. The (time, lon) surrogate is simulated in independent blocks of
+    years, one SeedSequence child per block, so results do not depend on the number of
+    workers. Within a block it is streamed chunk_years seasons at a time and never held
+    in full. Days above the per-longitude percentile of the stationary distribution are
+    tracked across longitude and time as in detect_events, and events of at least
+    min_duration days with onset in the region box are kept.
+
+    Parameters:
+    -----------
+    phi : np.ndarray
+        (nlon,) temp_corr per longitude, e.g. ds['temp_corr'].values of the red noise model file
+    sigma : float or np.ndarray
+        Standard deviation of band-mean LWA per longitude (square root of the variance)
+    lon : np.ndarray
+        (nlon,) longitudes of phi
+    region, season : str
+        e.g. "Atlantic", "DJF"
+    nyears : int
+        Number of surrogate seasons
+    mean : float or np.ndarray, default=0.0
+        Mean of band-mean LWA per longitude
+    box : array-like, optional
+        [Lon1, Lon2, Lat1, Lat2], defaults to Region_ERA; the surrogate has no latitude,
+        so event_lat is the middle of the box
+
+    Returns:
+    --------
+    xarray.Dataset
+        start_date, event_lon, event_lat, duration (event), return_period and recurrence,
+        with a noleap season time axis, as detect_events
+    """
+    phi = np.atleast_1d(np.asarray(phi, dtype=float))
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), phi.shape)
+    mean = np.broadcast_to(np.asarray(mean, dtype=float), phi.shape)
+    box = BlockingDetectionFunctions.Region_ERA(f"{region} {season}") if box is None else np.asarray(box)
+    season_days = BlockingDetectionFunctions.season_length(season)
+    threshold = mean + sigma * norm.ppf(percentile / 100)
+    lat = (box[2] + box[3]) / 2
+
+    seeds = np.random.SeedSequence(seed).spawn(int(np.ceil(nyears / years_per_block)))
+    jobs = [(phi, sigma, mean, threshold, lat, season_days, b*years_per_block,
+             min(years_per_block, nyears - b*years_per_block), chunk_years, s) for b, s in enumerate(seeds)]
+    if max_workers == 1:
+        found = [_simulate_block(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            found = list(pool.map(_simulate_block, jobs))
+
+    # Day numbers on a noleap calendar, one season per year starting in year 1
+    first_day = (np.arange(nyears) * 365 + (334 if season == "DJF" else 151))[:, None]
+    time = xr.decode_cf(xr.Dataset(coords={'time': ('time', (first_day + np.arange(season_days)).ravel(),
+                                                    {'units': 'days since 0001-01-01', 'calendar': 'noleap'})}))
+
+    attrs = {'data': 'Red noise model', 'region': region, 'season': season,
+             'percentile': percentile, 'min_duration': min_duration, 'seed': seed}
+    return EventDetectionFunctions.events_catalog(found, time['time'].values, np.asarray(lon), box, min_duration, attrs)
@@ -0,0 +1,139 @@
+'''
+Figure rendering code: run independent figure jobs on a process pool with the Agg backend
+'''
+import os
+import sys
+import time
+import resource
+import importlib
+import runpy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+def job(name, module, function, *args, **kwargs):
+    '''job calling module.function(*args, **kwargs), the function saves its own figure'''
+    return {'name': name, 'module': module, 'function': function, 'args': args, 'kwargs': kwargs}
+
+def with_files(spec, files):
+    '''job that reads files, opened in the background as it starts (and, rendering in one process, while the job before it renders)'''
+    return dict(spec, files=list(files))
+
+def script_job(name, script):
+    '''job running a whole figure script, e.g. distribution.py'''
+    return {'name': name, 'script': os.path.join(code_dir, script)}
+
+def _init_worker(memory_limit):
+    '''use Agg and cap the address space of each worker'''
+    if code_dir not in sys.path:
+        sys.path.insert(0, code_dir)
+    import matplotlib
+    matplotlib.use("Agg")
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+def render_job(spec):
+    """
+    Run one figure job, close its figures and report its cost
+
+    Returns:
+    --------
+    dict
+        name, status ('ok' or the error), wall and CPU time (s), peak RSS of the worker (MB),
+        and in a pool worker 'records', the InstrumentFunctions stage records of the job
+    """
+    import matplotlib.pyplot as plt
+    import InstrumentFunctions
+    import DataAccessFunctions
+    wall, cpu = time.perf_counter(), time.process_time()
+    # The job's files open together in the background while it reads the first of them
+    DataAccessFunctions.prefetch(spec.get('files', []))
+    try:
+        if 'script' in spec:
+            runpy.run_path(spec['script'], run_name="__render__")
+        else:
+            function = getattr(importlib.import_module(spec['module']), spec['function'])
+            function(*spec['args'], **spec['kwargs'])
+        status = 'ok'
+    except Exception as e:
+        status = f"{type(e).__name__}: {e}"
+    finally:
+        plt.close('all')
+    report = {
+        'name': spec['name'],
+        'status': status,
+        'wall_s': time.perf_counter() - wall,
+        'cpu_s': time.process_time() - cpu,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if multiprocessing.parent_process() is not None:
+        report['records'] = InstrumentFunctions.take()
+    return report
+
+def run_jobs(jobs, max_workers=None, max_tasks_per_child=4, memory_limit=None, verbose=True):
+    """
+    Render figure jobs in parallel
+
+    Workers are spawned fresh (so figure scripts are imported, not re-run), use the Agg
+    backend, close every figure after each job and are replaced after max_tasks_per_child
+    jobs so their memory does not grow over the run.
+
+    Parameters:
+    -----------
+    jobs : list of dict
+        From job() or script_job(), optionally with_files()
+    max_workers : int, optional
+        Worker processes, defaults to the number of cores; 1 renders in this process.
+        Every job opens its with_files() files on background threads as it starts; in
+        this process the files of the next job are also opened while a job renders
+    max_tasks_per_child : int, default=4
+        Jobs per worker before it is replaced
+    memory_limit : int, optional
+        Address-space limit per worker (bytes); a job exceeding it fails with MemoryError
+
+    Returns:
+    --------
+    list of dict
+        Per-job reports from render_job, in the order of jobs, without the stage records
+        merged into this process's
+    """
+    start = time.perf_counter()
+    if max_workers == 1:
+        _init_worker(None)
+        import DataAccessFunctions
+        reports = []
+        for i, spec in enumerate(jobs):
+            # Open the next job's files while this one renders, they share this process's handle cache
+            if i + 1 < len(jobs):
+                DataAccessFunctions.prefetch(jobs[i + 1].get('files', []))
+            reports.append(render_job(spec))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(memory_limit,),
+                                 max_tasks_per_child=max_tasks_per_child) as pool:
+            reports = list(pool.map(render_job, jobs))
+        # The workers' stage records join this process's, for GRL_REPORT and GRL_TRACE at exit
+        import InstrumentFunctions
+        for report in reports:
+            InstrumentFunctions.merge(report.pop('records', []))
+
+    if verbose:
+        for report in reports:
+            print(f"{report['name']:<40} {report['wall_s']:7.1f} s wall {report['cpu_s']:7.1f} s cpu "
+                  f"{report['peak_rss_mb']:8.0f} MB  {report['status']}")
+        total = sum(report['wall_s'] for report in reports)
+        print(f"{len(reports)} jobs: {time.perf_counter() - start:.1f} s elapsed, {total:.1f} s summed")
+    return reports
+
+def figure_jobs():
+    '''every figure job of the repository'''
+    import Comp_LWA, CESM_Hist, ERA_red_curve
+    jobs = Comp_LWA.figure_jobs() + CESM_Hist.figure_jobs() + ERA_red_curve.figure_jobs()
+    jobs += [script_job("distribution", "distribution.py"), job("table", "table", "render")]
+    return jobs
+
+if __name__ == "__main__":
+    import HistogramFunctions
+    HistogramFunctions.load_cube()  # build or refresh the cube once, before the jobs load it
+    run_jobs(figure_jobs())
@@ -0,0 +1,175 @@
+'''
+Threshold sensitivity code: catalogs and recurrence statistics for many LWA percentiles from one threshold pass and one tracking pass
+'''
+import os
+import numpy as np
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+import BlockingDetectionFunctions
+import EventDetectionFunctions
+import FitFunctions
+import InstrumentFunctions
+
+basepath = os.path.expanduser("~/Github")
+PERCENTILES = np.linspace(80, 99, 20)
+
+def season_axis(path, season, Lat1, Lat2, chunk_days=900, time_name="time", lat_name="lat", lon_name="lon"):
+    """
+    Season days, latitude band and time chunks of an LWA file, without reading the field
+
+    Returns:
+    --------
+    dict
+        'time_index' season rows of the file, 'times' their dates, 'lat_index' and 'lat'
+        of the band, 'lon', and 'chunks' contiguous_chunks rows of the season days
+    """
+    with xr.open_dataset(path) as ds:
+        time_index = EventDetectionFunctions.season_time_index(ds, season, time_name)
+        times = ds[time_name].values
+        days = BlockingDetectionFunctions.day_numbers(times)
+        lat_index = EventDetectionFunctions.lat_band_index(ds[lat_name].values, Lat1, Lat2)
+        return {'time_index': time_index, 'times': times[time_index], 'lat_index': lat_index,
+                'lat': ds[lat_name].values[lat_index], 'lon': ds[lon_name].values,
+                'chunks': EventDetectionFunctions.contiguous_chunks(time_index, days, chunk_days)}
+
+def band_chunks(path, axis, var_name="LWA", time_name="time", lat_name="lat", lon_name="lon"):
+    """
+    Band-mean LWA and latitude of the band maximum, one time chunk at a time
+
+    Yields:
+    -------
+    rows : slice
+        Rows of the chunk among the season days
+    continues : bool
+        Whether the chunk follows the previous one without a gap
+    band_mean, lat_of_max : np.ndarray
+        (ndays, nlon) of the chunk
+    """
+    with xr.open_dataset(path) as ds:
+        for rows, continues in axis['chunks']:
+            field = ds[var_name].isel({time_name: axis['time_index'][rows], lat_name: axis['lat_index']})
+            field = field.transpose(time_name, lat_name, lon_name).values
+            yield (rows, continues) + EventDetectionFunctions.band_reduce(field, axis['lat'])
+
+def threshold_levels(band_mean, threshold):
+    """
+    Number of thresholds each value exceeds, from one comparison against all of them
+
+    threshold[q] rises with q at every longitude, so band_mean > threshold[q] is the
+    same as level > q and the blocked masks of every percentile come from one array.
+
+    Parameters:
+    -----------
+    band_mean : np.ndarray
+        (ndays, nlon) one time chunk
+    threshold : np.ndarray
+        (nq, nlon) in ascending order of percentile
+
+    Returns:
+    --------
+    np.ndarray
+        (ndays, nlon) int16 level, 0 to nq
+    """
+    return (band_mean[:, :, None] > threshold.T[None]).sum(axis=2, dtype=np.int16)
+
+@InstrumentFunctions.instrumented
+def threshold_sweep(path, region, season, percentiles=PERCENTILES, min_duration=5, box=None,
+                    chunk_days=900, var_name="LWA", catalogs=False):
+    """
+    Onsets, intervals, α, φ fit and KDE mode of one region and season for a vector of percentiles
+
+    The thresholds of every percentile come from one pass over the file in longitude
+    slabs. A second pass streams it in time chunks: each chunk is compared with all
+    thresholds at once (threshold_levels) and every percentile tracks its events from
+    that level array, so memory is one chunk, not the season record. Each catalog
+    equals detect_events(path, region, season, percentile) on its own.
+
+    Parameters:
+    -----------
+    path : str
+        LWA NetCDF file with (time, lat, lon) variable var_name
+    percentiles : array-like, default=PERCENTILES
+        Climatological percentiles of the thresholds, 80 to 99
+    catalogs : bool, default=False
+        Also return the catalog of every percentile
+
+    Returns:
+    --------
+    xarray.Dataset
+        On dim percentile: nevent, alpha, phi, alpha_fit, nll, mode, mean, threshold (lon),
+        onset (time) and counts (return_period)
+    list of xarray.Dataset
+        Catalogs per percentile, when catalogs is True
+    """
+    percentiles = np.atleast_1d(np.asarray(percentiles, dtype=float))
+    box = BlockingDetectionFunctions.Region_ERA(f"{region} {season}") if box is None else np.asarray(box)
+    threshold = EventDetectionFunctions.percentile_threshold(path, season, box[2], box[3], percentiles, var_name)
+    ascending = np.argsort(percentiles, kind='stable')
+    position = np.argsort(ascending)  # rank of each percentile among the sorted ones
+    axis = season_axis(path, season, box[2], box[3], chunk_days)
+    season_times, lon = axis['times'], axis['lon']
+
+    states = [EventDetectionFunctions.initial_state(len(lon)) for _ in percentiles]
+    tracked = [[] for _ in percentiles]
+    for rows, continues, band_mean, lat_of_max in band_chunks(path, axis, var_name):
+        level = threshold_levels(band_mean, threshold[ascending])
+        for q in range(len(percentiles)):
+            closed, states[q] = EventDetectionFunctions.track_chunk(level > position[q], band_mean, lat_of_max,
+                                                                    states[q], continues)
+            tracked[q].append(closed)
+
+    found = []
+    for q, percentile in enumerate(percentiles):
+        tracked[q].append({key: states[q]['open'][key] for key in ('start', 'end', 'lon_index', 'lat')})
+        attrs = {'data': str(path), 'region': region, 'season': season,
+                 'percentile': percentile, 'min_duration': min_duration}
+        found.append(EventDetectionFunctions.events_catalog(tracked[q], season_times, lon, box, min_duration, attrs))
+
+    season_days = BlockingDetectionFunctions.season_length(season)
+    index = BlockingDetectionFunctions.timeline_index(season_times)
+    onset = np.array([BlockingDetectionFunctions.map_events_to_timeline(season_times, ds['start_date'].values, index)[0]
+                      for ds in found]).reshape(len(found), len(season_times))
+    return_periods = [ds['return_period'].values for ds in found]
+    counts, support = FitFunctions.return_period_counts(return_periods, season_days)
+    phi, alpha_fit, nll = FitFunctions.fit_curves(counts, support)
+    nevent = np.array([ds.sizes['event'] for ds in found])
+
+    summary = xr.Dataset(
+        {
+            'nevent': ('percentile', nevent),
+            'alpha': ('percentile', nevent / max(len(season_times), 1)),
+            'phi': ('percentile', phi),
+            'alpha_fit': ('percentile', alpha_fit),
+            'nll': ('percentile', nll),
+            'mode': ('percentile', BlockingDetectionFunctions.kde_modes(return_periods)),
+            'mean': ('percentile', [r.mean() if len(r) else np.nan for r in return_periods]),
+            'threshold': (('percentile', 'lon'), threshold),
+            'onset': (('percentile', 'time'), onset),
+            'counts': (('percentile', 'return_period'), counts),
+        },
+        coords={'percentile': percentiles, 'lon': lon, 'time': season_times,
+                'return_period': np.arange(counts.shape[1])},
+        attrs={'data': str(path), 'region': region, 'season': season, 'min_duration': min_duration},
+    )
+    return (summary, found) if catalogs else summary
+
+def _sweep_job(job):
+    '''worker wrapper for sweep_catalogs'''
+    return threshold_sweep(**job)
+
+def sweep_catalogs(jobs, max_workers=None):
+    """
+    Run threshold_sweep for many regions and ensemble members on a process pool
+
+    Parameters:
+    -----------
+    jobs : list of dict
+        Keyword arguments of threshold_sweep, one per region/season/member file
+
+    Returns:
+    --------
+    list of xarray.Dataset
+        Sweep summaries in the order of jobs
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_sweep_job, jobs))
@@ -0,0 +1,114 @@
+'''
+Significance code for LWA composites
+'''
+import numpy as np
+from scipy.stats import t as t_dist
+
+def block_tensor(data, block_size):
+    '''reshape (..., ndays, nlon) into (..., num_blocks_y, num_blocks_x, block_size**2), one copy of the trimmed field'''
+    data = np.asarray(data)
+    num_blocks_y = data.shape[-2] // block_size
+    num_blocks_x = data.shape[-1] // block_size
+    lead = data.shape[:-2]
+
+    trimmed = data[..., :num_blocks_y*block_size, :num_blocks_x*block_size]
+    blocks = trimmed.reshape(lead + (num_blocks_y, block_size, num_blocks_x, block_size))
+    blocks = np.swapaxes(blocks, -3, -2)
+    return blocks.reshape(lead + (num_blocks_y, num_blocks_x, block_size*block_size))
+
+def batched_ttest_1samp(blocks, null_hypothesis_mean, alternative='greater'):
+    """
+    One-sample t-test over the last axis of a block tensor, all blocks in one pass
+
+    Parameters:
+    -----------
+    blocks : np.ndarray
+        Block tensor of shape (..., num_blocks_y, num_blocks_x, n) from block_tensor
+    null_hypothesis_mean : float or np.ndarray
+        Null mean(s), broadcast against the leading (...) axes of blocks
+    alternative : str, default='greater'
+        'greater', 'less' or 'two-sided', as in scipy.stats.ttest_1samp
+
+    Returns:
+    --------
+    t_stat, p_values : np.ndarray
+        Arrays of shape broadcast(...) + (num_blocks_y, num_blocks_x)
+    """
+    n = blocks.shape[-1]
+    mu = np.asarray(null_hypothesis_mean, dtype=float)[..., None, None]
+
+    mean = blocks.mean(axis=-1)
+    sd = blocks.std(axis=-1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = (mean - mu) / (sd / np.sqrt(n))
+
+    if alternative == 'greater':
+        p_values = t_dist.sf(t_stat, n - 1)
+    elif alternative == 'less':
+        p_values = t_dist.cdf(t_stat, n - 1)
+    elif alternative == 'two-sided':
+        p_values = 2 * t_dist.sf(np.abs(t_stat), n - 1)
+    else:
+        raise ValueError("Invalid alternative. Choose 'greater', 'less' or 'two-sided'.")
+    return t_stat, p_values
+
+def blockwise_ttest(data, block_sizes=(4,), null_means=(0.5,), significance_level=0.05, alternative='greater'):
+    """
+    Block-wise t-test for several block sizes and null means in one call
+
+    Parameters:
+    -----------
+    data : np.ndarray
+        Composite of shape (ndays, nlon), or a stack of composites (..., ndays, nlon)
+    block_sizes : iterable of int
+        Block sizes to test
+    null_means : float or np.ndarray
+        Null mean(s); a 1D array gives one leading axis per null mean for a single composite,
+        a (k,) array for a (k, ndays, nlon) stack tests each composite against its own mean
+    significance_level : float, default=0.05
+    alternative : str, default='greater'
+
+    Returns:
+    --------
+    dict
+        {block_size: (p_values, significant_points)} with arrays of shape (..., num_blocks_y, num_blocks_x)
+    """
+    results = {}
+    for block_size in np.atleast_1d(block_sizes):
+        blocks = block_tensor(data, int(block_size))
+        _, p_values = batched_ttest_1samp(blocks, null_means, alternative)
+        results[int(block_size)] = (p_values, p_values < significance_level)
+    return results
+
+def significant_centers(significant_points, block_size, nlon, ndays):
+    '''return (N, 2) array of relative longitude/day centers of significant blocks, leading axes are pooled'''
+    i, j = np.nonzero(significant_points)[-2:]
+    x_center = j * block_size + block_size // 2 - int(nlon / 2)
+    y_center = i * block_size + block_size // 2 - int(ndays / 2)
+    return np.column_stack([x_center, y_center])
+
+def fdr_bh(p_values, q=0.05):
+    """
+    Benjamini-Hochberg false discovery rate control over all pixels
+
+    Parameters:
+    -----------
+    p_values : np.ndarray
+        Per-pixel p-values of any shape, NaN pixels are never significant
+    q : float, default=0.05
+        Expected proportion of false discoveries
+
+    Returns:
+    --------
+    np.ndarray
+        bool, shape of p_values
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    flat = p_values.ravel()
+    m = np.isfinite(flat).sum()
+    order = np.argsort(flat)  # NaN last
+    below = flat[order] <= q * np.arange(1, len(flat) + 1) / max(m, 1)
+    k = np.flatnonzero(below).max() + 1 if below.any() else 0
+    significant = np.zeros(len(flat), dtype=bool)
+    significant[order[:k]] = True
+    return significant.reshape(p_values.shape)
@@ -0,0 +1,211 @@
+#%% Benchmarks of the recurrence-analysis hot paths ##
+'''
+Benchmarks: time and peak memory of the analysis hot paths on synthetic LWA fields and event catalogs
+Scales run from one ERA5 season up to the 1799-year CESM1 control run and a 40-member ensemble.
+Runs offline on a CPU-only machine, e.g.
+    python benchmark.py --scale era5 cesm-control --json results.json
+    python benchmark.py --compare results.json
+'''
+import sys
+import json
+import time
+import argparse
+import warnings
+import tracemalloc
+import numpy as np
+import xarray as xr
+import BlockingDetectionFunctions
+import InstrumentFunctions
+
+# Each scale is members x years of one season on a daily grid
+SCALES = {
+    'era5-season': {'years': 1, 'members': 1, 'calendar': 'standard', 'nlon': 360, 'nlat': 20},
+    'era5': {'years': 44, 'members': 1, 'calendar': 'standard', 'nlon': 360, 'nlat': 20},
+    'cesm-ensemble': {'years': 20, 'members': 40, 'calendar': 'noleap', 'nlon': 288, 'nlat': 16},
+    'cesm-control': {'years': 1799, 'members': 1, 'calendar': 'noleap', 'nlon': 288, 'nlat': 16},
+}
+REGION, SEASON = "Atlantic", "DJF"
+ONSET_RATE = 0.02  # onsets per season day, about the ERA5 rate
+
+def season_times(years, calendar, first_year):
+    '''time axis of consecutive DJF seasons'''
+    if calendar == 'noleap':
+        days = xr.date_range(f"{first_year:04d}-12-01", f"{first_year + years:04d}-02-28", freq="D",
+                             calendar="noleap", use_cftime=True).values
+    else:
+        days = np.arange(f"{first_year}-12-01", f"{first_year + years}-03-01", dtype="datetime64[D]")
+    keep = BlockingDetectionFunctions.season_ranges(days, SEASON)
+    return np.concatenate([days[index] for index in keep.values()])
+
+def make_data(scale, seed=0):
+    """
+    Synthetic inputs of one scale
+
+    Returns:
+    --------
+    dict
+        Per member: time axis, onset mask and dates, return periods; plus composite stack,
+        a gridded dataset over the record (a zero-copy broadcast, so any scale fits in memory)
+        and a Hovmöller season
+    """
+    spec = SCALES[scale]
+    rng = np.random.default_rng(seed)
+    first_year = 402 if spec['calendar'] == 'noleap' else 1979
+    times = season_times(spec['years'], spec['calendar'], first_year)
+    lon = np.arange(spec['nlon']) * 360 / spec['nlon']
+    lat = np.linspace(80, 20, spec['nlat'])
+
+    members = []
+    for _ in range(spec['members']):
+        mask = rng.random(len(times)) < ONSET_RATE
+        members.append({'mask': mask, 'start_date': times[mask],
+                        'return_period': BlockingDetectionFunctions.onset_gaps(mask),
+                        'event_lon': rng.uniform(0, 360, mask.sum())})
+
+    field = np.broadcast_to(np.float32(1e9), (len(times), spec['nlat'], spec['nlon']))
+    ds = xr.Dataset({'LWA': (('time', 'lat', 'lon'), field)}, coords={'time': times, 'lat': lat, 'lon': lon})
+    season_days = BlockingDetectionFunctions.season_length(SEASON)
+    hovmoller = rng.gamma(2, 5e8, (season_days, spec['nlon']))
+    composites = rng.gamma(2, 5e8, (spec['members'] * 3, 41, 61))
+    return {'spec': spec, 'times': times, 'members': members, 'ds': ds, 'lon': lon,
+            'year': first_year + spec['years'] // 2, 'hovmoller': hovmoller, 'composites': composites}
+
+def clear_caches():
+    '''drop memoized calendar fields and region indexers, so every run is measured cold'''
+    BlockingDetectionFunctions._calendar_cache.clear()
+    BlockingDetectionFunctions._region_index_cache.clear()
+
+#%% Benchmarked functions, one call per member as in the analysis scripts
+def bench_kde(data):
+    import CESM_Hist
+    for member in data['members']:
+        CESM_Hist.kde(member['return_period'])
+
+def bench_blockwise_ttest(data):
+    import Comp_LWA
+    Stack = data['composites']
+    Comp_LWA.perform_blockwise_ttest(Stack, 2, Stack.mean(axis=(1, 2)), 0.01)
+
+def bench_interval(data):
+    import ERA_red_curve
+    for member in data['members']:
+        ERA_red_curve.interval(member['mask'])
+
+def bench_map_events(data):
+    for member in data['members']:
+        BlockingDetectionFunctions.map_events_to_timeline(data['times'], member['start_date'])
+
+def bench_curve_y(data):
+    import CESM_Hist
+    for member in data['members']:
+        CESM_Hist.curve_y("Hist", REGION, SEASON, len(member['start_date']), phi=0.8)
+
+def bench_y_curve(data):
+    import ERA_red_curve
+    x = np.arange(BlockingDetectionFunctions.season_length(SEASON))
+    for member in data['members']:
+        ERA_red_curve.y_curve(0.8, len(member['start_date']) / len(data['times']), x)
+
+def bench_data_filter(data):
+    import Hov_demo_Plot
+    for _ in data['members']:
+        Hov_demo_Plot.data_filter(data['ds'], REGION, SEASON, data['year'], "time", "lat", "lon")
+
+def bench_lon_fix(data):
+    import Hov_demo_Plot
+    lon = xr.DataArray(data['lon'], dims='lon', coords={'lon': data['lon']})
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for member in data['members']:
+            Hov_demo_Plot.lon_fix(lon, data['hovmoller'], member['event_lon'], REGION, SEASON)
+
+def bench_datetime_conversion(data):
+    BlockingDetectionFunctions.datetime_conversion(data['times'])
+    for member in data['members']:
+        BlockingDetectionFunctions.datetime_conversion(member['start_date'])
+
+BENCHMARKS = {
+    'kde': bench_kde,
+    'perform_blockwise_ttest': bench_blockwise_ttest,
+    'interval': bench_interval,
+    'map_events_to_timeline': bench_map_events,
+    'curve_y': bench_curve_y,
+    'y_curve': bench_y_curve,
+    'data_filter': bench_data_filter,
+    'lon_fix': bench_lon_fix,
+    'datetime_conversion': bench_datetime_conversion,
+}
+
+def measure(func, data, repeat=3):
+    """
+    Best wall time of repeat cold runs, and peak traced memory of one more run
+
+    A first untimed run imports the analysis scripts. Caches are cleared before every
+    run, and memory is traced in a separate run as tracemalloc slows down Python code.
+
+    Returns:
+    --------
+    seconds, peak_mb : float
+    """
+    func(data)
+    times = []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+    clear_caches()
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 2**20
+
+def run(scales=None, benchmarks=None, repeat=3, verbose=True):
+    '''results as {scale: {benchmark: {'seconds', 'peak_mb'}}}'''
+    InstrumentFunctions.set_verbosity(0)  # the analysis diagnostics, not the benchmark table
+    results = {}
+    for scale in scales or SCALES:
+        data = make_data(scale)
+        results[scale] = {}
+        for name in benchmarks or BENCHMARKS:
+            seconds, peak_mb = measure(BENCHMARKS[name], data, repeat)
+            results[scale][name] = {'seconds': seconds, 'peak_mb': peak_mb}
+            if verbose:
+                print(f"{scale:<14} {name:<24} {seconds*1e3:10.2f} ms {peak_mb:9.1f} MB")
+    return results
+
+def compare(results, baseline, tolerance=1.5):
+    '''(scale, benchmark, metric, baseline, new) of every metric more than tolerance times its baseline'''
+    regressions = []
+    for scale, benches in results.items():
+        for name, metrics in benches.items():
+            for metric, value in metrics.items():
+                old = baseline.get(scale, {}).get(name, {}).get(metric)
+                # Sub-millisecond timings and sub-megabyte peaks are noise
+                floor = 1e-3 if metric == 'seconds' else 1.0
+                if old is not None and value > tolerance * max(old, floor):
+                    regressions.append((scale, name, metric, old, value))
+    return regressions
+
+#%% main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the recurrence-analysis hot paths on synthetic data")
+    parser.add_argument("--scale", nargs="*", choices=list(SCALES), help="scales to run, default all")
+    parser.add_argument("--bench", nargs="*", choices=list(BENCHMARKS), help="benchmarks to run, default all")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the best is kept")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline results file, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown or memory growth factor")
+    args = parser.parse_args()
+
+    results = run(args.scale, args.bench, args.repeat)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for scale, name, metric, old, new in regressions:
+            print(f"regression {scale} {name} {metric}: {old:.4g} -> {new:.4g}")
+        sys.exit(1 if regressions else 0)
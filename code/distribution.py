@@ -9,6 +9,7 @@ from matplotlib.cm import get_cmap
 from matplotlib.colors import Normalize
 from matplotlib.lines import Line2D
 import os
+import CurveFunctions
 basepath = os.path.expanduser("~/Github")
 savingpath = f"{basepath}/plots/Fig4"
 
@@ -31,13 +32,10 @@ norm_phi = Normalize(vmin=min(phis), vmax=max(phis))
 
 axs[0].plot([], [],  color='w', label=f"α = {Pk_fixed}")
 
-for phi in phis:
-    P = (1 - phi**x) * Pk_fixed
-    y = P * ((1 - P) ** (x - 1))
-    y /= y.sum()
-    max_x = np.where(y == np.max(y))[0][0]
-    mean_y = np.sum(x * y)
-    sd_y = np.sqrt(np.sum(y * (x - mean_y) ** 2))
+curves_phi = CurveFunctions.recurrence_curve(phis, Pk_fixed, x)
+stats_phi = CurveFunctions.curve_moments(curves_phi, x)  # mode, mean, sd for each φ
+
+for phi, y in zip(phis, curves_phi):
     color = cmap_phi(norm_phi(phi))
     Label_text = fr"$\phi={phi:.1f}$"
     axs[0].plot(x, y, linewidth=2, color=color, label=f"{Label_text}")
@@ -55,13 +53,10 @@ norm_pk = Normalize(vmin=min(Pks), vmax=max(Pks))
 
 axs[1].plot([], [],  color='w', label=f"φ = {phi_fixed}")
 
-for Pk in Pks:
-    P = (1 - phi_fixed**x) * Pk
-    y = P * ((1 - P) ** (x - 1))
-    y /= y.sum()
-    max_x = np.where(y == np.max(y))[0][0]
-    mean_y = np.sum(x * y)
-    sd_y = np.sqrt(np.sum(y * (x - mean_y) ** 2))
+curves_pk = CurveFunctions.recurrence_curve(phi_fixed, Pks, x)
+stats_pk = CurveFunctions.curve_moments(curves_pk, x)  # mode, mean, sd for each α
+
+for Pk, y in zip(Pks, curves_pk):
     color = cmap_pk(norm_pk(Pk))
     Label_text = fr"$\alpha={Pk:.2f}$"
     axs[1].plot(x, y, linewidth=2, color=color, label=f"{Label_text}")